@@ -0,0 +1,179 @@
+'''
+正则表达式的字面量预过滤：分析每个pattern，取出匹配时必须出现的字面量集合（句子至少包含其中一个），
+所有字面量建成一个Aho-Corasick自动机，扫描一遍句子就知道哪些pattern可能匹配，只对这些pattern执行正则；
+取不出字面量的pattern（如 \\d+、.*、忽略大小写）每个句子都执行
+'''
+import re
+try:
+    from re import _parser as sre_parse  # python3.11+
+except ImportError:
+    import sre_parse
+
+MAX_LITERALS = 64  # 单个pattern的字面量集合最多展开的字符串数
+MAX_RANGE = 16  # 字符集中的范围（如[a-f]）最多展开的字符数
+
+
+def _node_literals(op, av):
+    """
+    @return exact: set, 该节点能匹配的所有字符串，无法枚举时为None
+    @return required: set, 该节点匹配时必须包含其中一个字符串，没有时为None
+    """
+    if op is sre_parse.LITERAL:
+        return {chr(av)}, {chr(av)}
+    if op is sre_parse.AT:  # ^ $ \b 等零宽位置
+        return {''}, None
+    if op is sre_parse.IN:
+        chars = set()
+        for item_op, item_av in av:
+            if item_op is sre_parse.LITERAL:
+                chars.add(chr(item_av))
+            elif item_op is sre_parse.RANGE and item_av[1] - item_av[0] < MAX_RANGE:
+                chars.update(chr(c) for c in range(item_av[0], item_av[1] + 1))
+            else:  # NEGATE、CATEGORY、大范围
+                return None, None
+        return chars, chars
+    if op is sre_parse.BRANCH:
+        branches = [_sequence_literals(branch) for branch in av[1]]
+        exact = None
+        if all(branch_exact is not None for branch_exact, _ in branches):
+            exact = set().union(*[branch_exact for branch_exact, _ in branches])
+        required = None
+        if all(branch_required is not None for _, branch_required in branches):
+            required = set().union(*[branch_required for _, branch_required in branches])
+        return _limit(exact), _limit(required)
+    if op is sre_parse.SUBPATTERN:
+        group, add_flags, del_flags, sub = av
+        if add_flags & re.IGNORECASE:
+            return None, None
+        return _sequence_literals(sub)
+    if op is getattr(sre_parse, 'ATOMIC_GROUP', None):
+        return _sequence_literals(av)
+    if op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT, getattr(sre_parse, 'POSSESSIVE_REPEAT', None)):
+        min_count, max_count, sub = av
+        if max_count == 0:
+            return {''}, None
+        sub_exact, sub_required = _sequence_literals(sub)
+        if min_count == 0:
+            return None, None
+        return (sub_exact if min_count == max_count == 1 else None), sub_required
+    if op is sre_parse.ASSERT:  # 正向的前瞻/后顾，内容也在句子中，但不参与前后拼接
+        direction, sub = av
+        return None, _sequence_literals(sub)[1]
+    return None, None  # ANY、NOT_LITERAL、CATEGORY、ASSERT_NOT、GROUPREF等
+
+
+def _limit(literals):
+    return literals if literals is not None and len(literals) <= MAX_LITERALS else None
+
+
+def _best(candidates):
+    """
+    在多个必须出现的字面量集合中取最有区分度的一个：最短字符串最长，其次字符串数最少
+    """
+    candidates = [literals for literals in candidates if literals and '' not in literals]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda literals: (min(len(s) for s in literals), -len(literals)))
+
+
+def _sequence_literals(sequence):
+    """
+    顺序拼接的节点：相邻的可枚举节点拼接成更长的字面量，不可枚举的节点把序列断开
+    @return: (exact, required)，含义同_node_literals
+    """
+    current = {''}
+    candidates = []
+    broken = False
+    for op, av in sequence:
+        exact, required = _node_literals(op, av)
+        if exact is not None and len(current) * len(exact) <= MAX_LITERALS:
+            current = {prefix + suffix for prefix in current for suffix in exact}
+            continue
+        broken = True
+        candidates.append(current)
+        candidates.append(required)
+        current = {''}
+    candidates.append(current)
+    return (None if broken else current), _best(candidates)
+
+
+def required_literals(pattern):
+    '''
+    @param pattern: str, 正则表达式
+    @return: frozenset, 匹配到的句子必须包含其中至少一个字面量；取不出时返回None
+    '''
+    try:
+        parsed = sre_parse.parse(pattern)
+    except (re.error, TypeError):
+        return None
+    if parsed.state.flags & re.IGNORECASE:
+        return None
+    required = _sequence_literals(parsed)[1]
+    return frozenset(required) if required else None
+
+
+class AhoCorasick(object):
+    def __init__(self, words):
+        """
+        @param words: {str: [int]}, 字面量及其对应的pattern编号
+        """
+        self.goto = [{}]
+        self.output = [set()]  # 每个状态匹配到的pattern编号（包含fail链上的）
+        for word, ids in words.items():
+            state = 0
+            for char in word:
+                if char not in self.goto[state]:
+                    self.goto.append({})
+                    self.output.append(set())
+                    self.goto[state][char] = len(self.goto) - 1
+                state = self.goto[state][char]
+            self.output[state].update(ids)
+        self.fail = [0] * len(self.goto)  # 第一层的fail为根节点
+        queue = list(self.goto[0].values())
+        for state in queue:  # 按层遍历，父节点的fail先于子节点确定
+            for char, child in self.goto[state].items():
+                queue.append(child)
+                fail = self.fail[state]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[child] = self.goto[fail].get(char, 0)
+                self.output[child] |= self.output[self.fail[child]]
+        self.output = [frozenset(ids) for ids in self.output]
+
+    def find(self, text):
+        """
+        @param text: str
+        @return: set, text中出现的字面量对应的pattern编号
+        """
+        goto, fail, output = self.goto, self.fail, self.output
+        found = set()
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                found |= output[state]
+        return found
+
+
+class LiteralPrefilter(object):
+    def __init__(self, patterns):
+        """
+        @param patterns: [str], 正则表达式，编号为在列表中的下标
+        """
+        self.literals = [required_literals(pattern) for pattern in patterns]
+        self.always = frozenset(i for i, literals in enumerate(self.literals) if literals is None)
+        words = {}
+        for i, literals in enumerate(self.literals):
+            for literal in literals or ():
+                words.setdefault(literal, []).append(i)
+        self.automaton = AhoCorasick(words)
+
+    def candidates(self, sentence):
+        """
+        @param sentence: str
+        @return: set, 可能匹配sentence的pattern编号，其余的pattern一定不匹配
+        """
+        found = self.automaton.find(sentence)
+        return found | self.always if self.always else found
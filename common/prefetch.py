@@ -0,0 +1,53 @@
+'''
+有界预读：后台线程提前读取迭代器中的数据，读取（如数据库游标）与分析重叠进行
+'''
+import queue
+import threading
+
+_ITEM, _END, _ERROR = 0, 1, 2
+
+
+def prefetch(iterable, size):
+    '''
+    后台线程最多预读size项，按原顺序逐项返回
+    @param iterable: 任意可迭代对象，如数据库游标
+    @param size: int, 预读缓冲区大小，为0时不预读，直接迭代
+    @return: generator
+    '''
+    if not size:
+        for item in iterable:
+            yield item
+        return
+    buffer = queue.Queue(maxsize=size)
+    stop = threading.Event()
+
+    def put(kind, value):
+        while not stop.is_set():
+            try:
+                buffer.put((kind, value), timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def producer():
+        try:
+            for item in iterable:
+                if not put(_ITEM, item):
+                    return
+            put(_END, None)
+        except BaseException as e:
+            put(_ERROR, e)
+
+    thread = threading.Thread(target=producer, daemon=True)
+    thread.start()
+    try:
+        while True:
+            kind, value = buffer.get()
+            if kind == _END:
+                return
+            if kind == _ERROR:
+                raise value
+            yield value
+    finally:  # 调用方提前结束迭代时通知后台线程退出
+        stop.set()
@@ -0,0 +1,77 @@
+'''
+预编译一组正则表达式：key_point_match按业务分类合并所有关键点的pattern，
+smart_text_analyzer按target合并所有text analyzer的pattern
+'''
+import re
+from common.literal_prefilter import LiteralPrefilter
+
+BACKREFERENCE = re.compile(r'\\[1-9]|\(\?P=')  # 合并后分组序号会变化，含反向引用的pattern不能合并
+
+
+class RegexScanner(object):
+    def __init__(self, keypoint_patterns):
+        """
+        加载时编译所有pattern，并从每个pattern中取出必须出现的字面量建成Aho-Corasick自动机（literal_prefilter.py），
+        扫描一遍句子就能排除字面量不在句子中的pattern；有取不出字面量的pattern时，
+        再用所有pattern合并成的有序alternation扫描一遍，排除不包含任何pattern的句子
+        @param keypoint_patterns: list, 按关键点顺序 [("关键点1", [str, str]), ("关键点2", [])]
+        """
+        self.keypoint_patterns = []  # [("关键点1", [(pattern, compiled, 编号)])]
+        all_patterns = []
+        for keypoint, patterns in keypoint_patterns:
+            if not patterns:
+                continue
+            self.keypoint_patterns.append((keypoint, [(pattern, re.compile(pattern), len(all_patterns) + i)
+                                                      for i, pattern in enumerate(patterns)]))
+            all_patterns.extend(patterns)
+        self.prefilter = LiteralPrefilter(all_patterns)
+        self.stats = {"sentences": 0,  # 扫描的句子数
+                      "hits": 0,  # 预过滤后仍需执行正则的句子数
+                      "skips": 0,  # 预过滤直接排除的句子数
+                      "regex_run": 0,  # 执行的pattern数
+                      "regex_skipped": 0}  # 预过滤跳过的pattern数
+        self.combined = None
+        if all_patterns and not any(BACKREFERENCE.search(pattern) for pattern in all_patterns):
+            try:
+                self.combined = re.compile('|'.join('(?:%s)' % pattern for pattern in all_patterns))
+            except re.error:  # 无法合并的pattern（如重名的分组）时，逐个pattern匹配
+                self.combined = None
+
+    def scan(self, sentence):
+        """
+        返回所有匹配到的关键点，每个关键点内取第一个匹配到的pattern
+        @param sentence: str, 原句
+        @return: list, 按关键点顺序 [{'sentence': sentence, 'keypoint': '', 'score': 1, 'compared_source': '', 'regex': pattern}]
+        """
+        return [{'sentence': sentence,  # 原子句
+                 'keypoint': keypoint,
+                 'score': 1,  # 相似度分值
+                 'compared_source': '',
+                 'regex': pattern} for keypoint, pattern in self.matches(sentence)]
+
+    def matches(self, sentence):
+        """
+        @param sentence: str, 原句
+        @return: list, 按关键点顺序 [("关键点1", 第一个匹配到的pattern)]
+        """
+        result = []
+        if not self.keypoint_patterns:
+            return result
+        stats = self.stats
+        stats["sentences"] += 1
+        candidates = self.prefilter.candidates(sentence)
+        if not candidates or (self.prefilter.always and self.combined is not None
+                              and not self.combined.search(sentence)):
+            stats["skips"] += 1
+            return result
+        stats["hits"] += 1
+        for keypoint, patterns in self.keypoint_patterns:
+            for pattern, compiled, pattern_id in patterns:
+                if pattern_id not in candidates:  # 必须出现的字面量不在句子中，一定不匹配
+                    stats["regex_skipped"] += 1
+                    continue
+                stats["regex_run"] += 1
+                if compiled.search(sentence):
+                    result.append((keypoint, pattern))
+                    break
+        return result
@@ -0,0 +1,131 @@
+'''
+共用的分词：jieba分词并去掉停用词，停用词为frozenset，自定义词典只加载一次，分词结果有LRU缓存，
+批量分词时可以把未命中缓存的句子分给多个进程
+'''
+import multiprocessing
+from collections import OrderedDict
+import jieba
+
+_loaded_dicts = set()  # 已经加载过的自定义词典，jieba的词典为进程内共用
+_worker_tokenizer = None  # fork之前设置，子进程直接继承
+
+
+def load_stopwords(paths):
+    '''
+    @param paths: [str], 停用词文件，每行一个
+    @return: frozenset
+    '''
+    stopwords = set()
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            stopwords.update(line.strip() for line in f)
+    return frozenset(stopwords)
+
+
+def load_user_dicts(paths):
+    '''
+    加载jieba自定义词典，同一个词典只加载一次
+    @param paths: [str]
+    '''
+    for path in paths:
+        if path not in _loaded_dicts:
+            jieba.load_userdict(path)
+            _loaded_dicts.add(path)
+
+
+class Tokenizer(object):
+    def __init__(self, stopword_paths=(), user_dicts=(), cache_size=100000):
+        """
+        @param stopword_paths: [str], 停用词文件
+        @param user_dicts: [str], jieba自定义词典
+        @param cache_size: int, 缓存的句子数，为0时不缓存
+        """
+        self.stopwords = load_stopwords(stopword_paths)
+        load_user_dicts(user_dicts)
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+
+    def cut_uncached(self, sentence):
+        """
+        @param sentence: str
+        @return: tuple, 去掉停用词后的词
+        """
+        return tuple(word for word in jieba.cut(sentence) if word not in self.stopwords)
+
+    def cut(self, sentence):
+        """
+        @param sentence: str
+        @return: tuple, 去掉停用词后的词，与缓存共用，不要修改
+        """
+        words = self._cache.get(sentence)
+        if words is not None:
+            self._cache.move_to_end(sentence)
+            self.hits += 1
+            return words
+        self.misses += 1
+        words = self.cut_uncached(sentence)
+        self.put(sentence, words)
+        return words
+
+    def put(self, sentence, words):
+        if self.cache_size <= 0:
+            return
+        self._cache[sentence] = words
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def cut_batch(self, sentences, processes=1, chunksize=64):
+        """
+        批量分词，未命中缓存的句子去重后分词，processes>1时分给fork的进程池
+        @param sentences: [str]
+        @param processes: int, 进程数
+        @param chunksize: int, 每次分发给一个进程的句子数
+        @return: [tuple], 与sentences一一对应
+        """
+        result = []
+        missing = {}  # {未命中的句子: None}, 有序去重
+        for sentence in sentences:
+            words = self._cache.get(sentence)
+            if words is None:
+                self.misses += 1
+                missing[sentence] = None
+            else:
+                self._cache.move_to_end(sentence)
+                self.hits += 1
+            result.append(words)
+        missing = list(missing)
+        if processes > 1 and len(missing) > chunksize:
+            global _worker_tokenizer
+            jieba.initialize()  # fork之前加载词典，子进程不需要重新加载
+            _worker_tokenizer = self
+            try:
+                with multiprocessing.get_context("fork").Pool(processes=processes) as pool:
+                    cut = pool.map(_cut_worker, missing, chunksize=chunksize)
+            finally:
+                _worker_tokenizer = None
+        else:
+            cut = [self.cut_uncached(sentence) for sentence in missing]
+        cut = dict(zip(missing, cut))
+        for sentence, words in cut.items():
+            self.put(sentence, words)
+        return [cut[sentence] if words is None else words for sentence, words in zip(sentences, result)]
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self):
+        """
+        @return: {"hits": int, "misses": int, "hit_rate": float, "size": int, "capacity": int}
+        """
+        total = self.hits + self.misses
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": float(self.hits) / total if total else 0.0,
+                "size": len(self._cache),
+                "capacity": self.cache_size}
+
+
+def _cut_worker(sentence):
+    return _worker_tokenizer.cut_uncached(sentence)
@@ -133,6 +133,36 @@ class DialogsDAO(object):
             error_logger.error("从数据库读取对话时发生其他错误, %s", traceback.format_exc(), extra={"host": 'localhost'})
             raise BaseException("从数据库读取对话时发生其他错误")
 
+    @staticmethod
+    def iter_dialogs(start_time_s, end_time_s):
+        """
+        逐条返回对应时间段内的对话，用数据库游标逐行读取，不一次性加载到内存，可直接传给iter_test
+        params start_time_s:str,2018-09-13 00:00:00
+        params end_time_s:str,2018-09-14 00:00:00
+        """
+        start_time = datetime.strptime(start_time_s, "%Y-%m-%d %H:%M:%S")
+        end_time = datetime.strptime(end_time_s, "%Y-%m-%d %H:%M:%S")
+        try:
+            dialogs = (Dialogs.select().where((Dialogs.begin_time >= start_time) & (Dialogs.begin_time <= end_time))).iterator()
+            for dialog in dialogs:
+                yield {
+                    "id": dialog.id,
+                    "call_id": dialog.call_id,
+                    "caller_no": dialog.caller_no,
+                    "callee_no": dialog.callee_no,
+                    "begin_time": dialog.begin_time,  # datetime
+                    "end_time": dialog.end_time,  # datetime
+                    "transcripts": [] if dialog.transcripts=='' else json.loads(dialog.transcripts),
+                    "emotion": dialog.emotion,
+                    "silence":dialog.silence,
+                    "interruption": dialog.interruption,
+                    "status": dialog.status,
+                    "session_id" : dialog.session_id
+                }
+        except Exception:  # 调用方提前结束迭代时的GeneratorExit不属于读取错误
+            error_logger.error("从数据库读取对话时发生其他错误, %s", traceback.format_exc(), extra={"host": 'localhost'})
+            raise BaseException("从数据库读取对话时发生其他错误")
+
     @staticmethod
     def upload_audio_to_info(call_id, session_id):
         '''
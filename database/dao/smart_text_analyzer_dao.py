@@ -4,6 +4,7 @@ import traceback
 import uuid
 import datetime
 from peewee import OperationalError
+from peewee import fn
 from database.model.smart_text_analyzer_model import SmartTextAnalyzerModel
 
 info_logger = logging.getLogger("info")
@@ -27,6 +28,65 @@ class SmartTextAnalyzerDAO(object):
         except Exception as e:
             error_logger.error("从数据库读取SmartTextAnalyzer时发生其他错误, %s", traceback.format_exc(), extra={"host": 'localhost'})
 
+    @staticmethod
+    def pack_analyzer(analyzer):
+        return {
+            "id": analyzer.id,
+            "name": analyzer.name,
+            "description": analyzer.description,
+            "target": analyzer.target,
+            "matched_sentences": analyzer.matched_sentences.split('\n'),  # list
+            "threshold": analyzer.threshold,
+            "regex": analyzer.regex.split('\n'),  # list
+            "mode": analyzer.mode,
+            "created_datetime": analyzer.created_datetime
+        }
+
+    @staticmethod
+    def load_all_analyzers():
+        '''
+        @Description: 一次查询读取所有SmartTextAnalyzer的全部字段，代替view_all_analyzers + 逐个view_analyzer_by_id
+        @Return: [{"id": str, "name": str, ...}], 每一项与view_analyzer_by_id的结果一致；出错时返回None
+        '''
+        try:
+            analyzers = (SmartTextAnalyzerModel.select()).execute()
+            return [SmartTextAnalyzerDAO.pack_analyzer(analyzer) for analyzer in analyzers]
+        except Exception as e:
+            error_logger.error("从数据库读取SmartTextAnalyzer时发生其他错误, %s", traceback.format_exc(), extra={"host": 'localhost'})
+
+    @staticmethod
+    def load_analyzers_by_ids(analyzer_ids):
+        '''
+        @Description: 一次查询读取指定id的SmartTextAnalyzer
+        @param analyzer_ids: [str]
+        @Return: [{"id": str, "name": str, ...}], 出错时返回None
+        '''
+        try:
+            if not analyzer_ids:
+                return []
+            analyzers = (SmartTextAnalyzerModel.select().where(SmartTextAnalyzerModel.id.in_(list(analyzer_ids)))).execute()
+            return [SmartTextAnalyzerDAO.pack_analyzer(analyzer) for analyzer in analyzers]
+        except Exception as e:
+            error_logger.error("从数据库读取SmartTextAnalyzer时发生其他错误, %s", traceback.format_exc(), extra={"host": 'localhost'})
+
+    @staticmethod
+    def view_analyzer_versions():
+        '''
+        @Description: 只读取id和数据库中计算的所有字段内容的md5，用于轮询哪些analyzer被创建、修改或删除；
+                      created_datetime只精确到秒，同一秒内的多次修改区分不出来，所以按内容计算版本号
+        @Return: {id: md5}, 出错时返回None
+        '''
+        try:
+            model = SmartTextAnalyzerModel
+            # CONCAT_WS跳过NULL，NULL记为\x00，与空字符串区分，也不会让后面的字段错位
+            fields = [model.name, model.description, model.target, model.matched_sentences, model.threshold, model.regex,
+                      model.mode]
+            version = fn.MD5(fn.CONCAT_WS('\x1f', *[fn.COALESCE(field, '\x00') for field in fields]))
+            analyzers = (model.select(model.id, version)).tuples()
+            return {analyzer_id: analyzer_version for analyzer_id, analyzer_version in analyzers}
+        except Exception as e:
+            error_logger.error("从数据库读取SmartTextAnalyzer时发生其他错误, %s", traceback.format_exc(), extra={"host": 'localhost'})
+
     @staticmethod
     def view_analyzer_by_id(analyzer_id):
         try:
@@ -0,0 +1,362 @@
+'''
+话术匹配性能测试
+'''
+import copy
+import hashlib
+import json
+import os
+import random
+import sys
+import time
+import jieba
+import numpy as np
+import utils
+from keypoint_analyzer import KeyPointAnalyzer
+from vector_index import TopicVectorIndex
+from ivf_index import TopicIVFIndex
+
+FILLER = "嗯好的那个您稍等一下我这边帮您看一下是这样的然后呢就是说"
+CUSTOMER_PHRASES = ["我想问一下我的账单", "好的", "嗯", "那我现在要怎么办", "这个要多久能到账",
+                    "你们这个利息怎么算", "我没听清楚你再说一遍", "可以", "不用了谢谢", "我的卡在身上"]
+
+
+class StandInKeyedVectors(object):
+    def __init__(self, words, size):
+        self.index2word = list(words)
+        self.vocab = {word: i for i, word in enumerate(self.index2word)}
+        self.vectors = np.vstack([word_vector(word, size) for word in self.index2word])
+
+    def __getitem__(self, word):
+        return self.vectors[self.vocab[word]]
+
+
+class StandInWord2Vec(object):
+    def __init__(self, sentences, size=32):
+        """
+        离线性能测试用的小词向量模型：词表为句子分词结果，每个词的向量由词的md5确定，结果可复现
+        @param sentences: [str], 用于构建词表的句子
+        @param size: int, 词向量维度
+        """
+        words = set()
+        for sentence in sentences:
+            words.update(jieba.cut(sentence))
+        self.wv = StandInKeyedVectors(sorted(words), size)
+
+    def __getitem__(self, word):
+        return self.wv[word]
+
+
+def word_vector(word, size):
+    seed = int(hashlib.md5(word.encode('utf-8')).hexdigest()[:8], 16)
+    return np.random.RandomState(seed).randn(size).astype(np.float32)
+
+
+def add_noise(sentence, rnd, noise):
+    '''
+    按比例随机删字、插入填充字，模拟语音识别的误差
+    '''
+    chars = []
+    for char in sentence:
+        if rnd.random() < noise:
+            continue
+        chars.append(char)
+        if rnd.random() < noise:
+            chars.append(rnd.choice(FILLER))
+    return ''.join(chars)
+
+
+def synthetic_dialogs(compare_corpus, topic, count, turns=20, agent_ratio=0.5, noise=0.1, seed=0):
+    '''
+    用匹配库句子加噪声拼出合成对话
+    @param compare_corpus: 匹配库
+    @param topic: string, '现金分期'
+    @param count: int, 对话数
+    @param turns: int, 每个对话的句子数
+    @param agent_ratio: float, 坐席句子的比例
+    @param noise: float, 每个字被删除或后面插入填充字的概率
+    @return: [{"transcripts": [{},{}], "id": str, "topic":str}]
+    '''
+    rnd = random.Random(seed)
+    phrases = [sentence for keypoint in compare_corpus[topic].values() for sentence in keypoint["compared_corpus"]]
+    dialogs = []
+    for num in range(count):
+        transcripts = []
+        for turn in range(turns):
+            if rnd.random() < agent_ratio:
+                start = rnd.randrange(len(FILLER))
+                speech = FILLER[start: start + rnd.randint(0, 10)] + add_noise(rnd.choice(phrases), rnd, noise)
+                target = "坐席"
+            else:
+                speech = add_noise(rnd.choice(CUSTOMER_PHRASES), rnd, noise)
+                target = "客户"
+            transcripts.append({"target": target, "speech": speech,
+                                "start_time": "%.2f" % (turn * 5.0), "end_time": "%.2f" % (turn * 5.0 + 4.5)})
+        dialogs.append({"transcripts": transcripts, "id": str(num), "topic": topic})
+    return dialogs
+
+
+def count_windows(analyzer, dialog, method):
+    '''
+    每种方法要匹配的句子数：levenshtein为坐席句子的滑窗子句数，regex和word2vec为整句数，test为三者之和
+    '''
+    transcripts = dialog["transcripts"]
+    windows = {"run_regex": len(transcripts), "run_word2vec": len(transcripts),
+               "run_levenshtein": sum(len(analyzer.split_windows(item["speech"], 10, 3))
+                                      for item in transcripts if item["target"] == "坐席")}
+    if method == "test":
+        return sum(windows.values())
+    return windows[method]
+
+
+def benchmark_dialogs(analyzer, dialogs, methods=("run_levenshtein", "run_regex", "run_word2vec", "test")):
+    '''
+    逐个对话计时
+    @param analyzer: KeyPointAnalyzer
+    @param dialogs: synthetic_dialogs的结果
+    @return: {method: {"dialogs_per_second": float, "windows_per_second": float,
+                       "p50_ms": float, "p95_ms": float, "p99_ms": float}}
+    '''
+    report = {}
+    for method in methods:
+        dialogs_copy = copy.deepcopy(dialogs)
+        latency = []
+        windows = 0
+        for dialog in dialogs_copy:
+            windows += count_windows(analyzer, dialog, method)
+            t = time.time()
+            if method == "test":
+                analyzer.test([dialog])
+            else:
+                getattr(analyzer, method)(transcripts=dialog["transcripts"], topic=dialog["topic"])
+            latency.append(time.time() - t)
+        seconds = sum(latency)
+        p50, p95, p99 = np.percentile(latency, [50, 95, 99]) * 1000
+        report[method] = {"dialogs_per_second": len(dialogs) / seconds if seconds else 0.0,
+                          "windows_per_second": windows / seconds if seconds else 0.0,
+                          "p50_ms": p50, "p95_ms": p95, "p99_ms": p99}
+    return report
+
+
+def long_utterances(compare_corpus, topic, count, min_length=100, seed=0):
+    '''
+    用匹配库句子和填充语拼出长句，模拟坐席的长段话术
+    @param compare_corpus: 匹配库
+    @param topic: string, '现金分期'
+    @param count: int, 句子数
+    @param min_length: int, 每句最少字数
+    @return: [str]
+    '''
+    rnd = random.Random(seed)
+    phrases = [sentence for keypoint in compare_corpus[topic].values() for sentence in keypoint["compared_corpus"]]
+    utterances = []
+    for i in range(count):
+        utterance = ""
+        while len(utterance) < min_length:
+            start = rnd.randrange(len(FILLER))
+            utterance += FILLER[start: start + rnd.randint(3, 12)] + rnd.choice(phrases)
+        utterances.append(utterance)
+    return utterances
+
+
+def benchmark_levenshtein_modes(analyzer, topic, utterances, repeat=1):
+    '''
+    滑窗模式与子串对齐模式的耗时和匹配结果对比
+    @param analyzer: KeyPointAnalyzer, 建议cache_size=0，避免缓存影响计时
+    @param topic: string, '现金分期'
+    @param utterances: [str], 坐席长句
+    @return: {"window": {"seconds": float, "utterances_per_second": float, "keypoints": int},
+              "alignment": {...}}
+    '''
+    transcripts = [[{"target": "坐席", "speech": utterance, "start_time": "0.00", "end_time": "1.00"}]
+                   for utterance in utterances]
+    report = {}
+    for mode in ["window", "alignment"]:
+        keypoints = 0
+        t = time.time()
+        for i in range(repeat):
+            for transcript in transcripts:
+                keypoints += len(analyzer.run_levenshtein(transcripts=transcript, topic=topic, mode=mode) or [])
+        seconds = time.time() - t
+        report[mode] = {"seconds": seconds,
+                        "utterances_per_second": len(utterances) * repeat / seconds if seconds else 0.0,
+                        "keypoints": keypoints // repeat}
+    return report
+
+
+def synthetic_topic(compare_corpus, keypoints, sentences_per_keypoint, noise=0.2, seed=0):
+    '''
+    用所有业务分类的匹配句加噪声拼出一个大的业务分类，模拟匹配库很大时的向量索引
+    @param keypoints: int, 关键点数
+    @param sentences_per_keypoint: int, 每个关键点的匹配句数
+    @return: {"关键点": {"compared_corpus": [str], "threshold": {"levenshtein": 0.7, "word2vec": 0.9}, "patterns": []}}
+    '''
+    rnd = random.Random(seed)
+    phrases = [sentence for topic in compare_corpus.values() for keypoint in topic.values()
+               for sentence in keypoint["compared_corpus"]]
+    topic_corpus = {}
+    for num in range(keypoints):
+        base = rnd.sample(phrases, 3)
+        topic_corpus["关键点%d" % num] = {
+            "compared_corpus": [add_noise(rnd.choice(base), rnd, noise) + rnd.choice(base)[:rnd.randint(0, 5)]
+                                for i in range(sentences_per_keypoint)],
+            "threshold": {"levenshtein": 0.7, "word2vec": 0.9},
+            "patterns": []}
+    return topic_corpus
+
+
+def benchmark_ivf(vector_index, sentences, settings, repeat=1):
+    '''
+    精确打分与IVF近似索引的召回率和耗时对比
+    @param vector_index: TopicVectorIndex
+    @param sentences: [str], 查询句子
+    @param settings: [{"nlist": int, "nprobe": int}]
+    @return: {"exact": {"ms_per_query": float},
+              "nlist=..,nprobe=..": {"ms_per_query": float, "build_seconds": float,
+                                     "recall": float,  # 精确结果中的(关键点, 匹配句)被近似索引找到的比例
+                                     "same_result": float}}  # 与精确结果完全一致的查询比例
+    '''
+    vectors = utils.get_vec_batch(sentences)[0]
+    t = time.time()
+    for i in range(repeat):
+        exact = [vector_index.match(sentence, vec) for sentence, vec in zip(sentences, vectors)]
+    report = {"exact": {"ms_per_query": (time.time() - t) * 1000 / (len(sentences) * repeat)}}
+    for setting in settings:
+        t = time.time()
+        ivf_index = TopicIVFIndex(vector_index, **setting)
+        build_seconds = time.time() - t
+        t = time.time()
+        for i in range(repeat):
+            approximate = [ivf_index.match(sentence, vec) for sentence, vec in zip(sentences, vectors)]
+        ms_per_query = (time.time() - t) * 1000 / (len(sentences) * repeat)
+        found = total = same = 0
+        for exact_result, approximate_result in zip(exact, approximate):
+            expected = set((item['keypoint'], item['compared_source']) for item in exact_result)
+            total += len(expected)
+            found += len(expected & set((item['keypoint'], item['compared_source']) for item in approximate_result))
+            same += exact_result == approximate_result
+        report["nlist=%d,nprobe=%d" % (ivf_index.nlist, ivf_index.nprobe)] = {
+            "ms_per_query": ms_per_query,
+            "build_seconds": build_seconds,
+            "recall": float(found) / total if total else 1.0,
+            "same_result": float(same) / len(sentences)}
+    return report
+
+
+def unique_nbytes(arrays):
+    '''
+    @return: int, 多个数组占用的字节数，共享内存的数组只计一次
+    '''
+    counted = []
+    for array in arrays:
+        if not any(np.may_share_memory(array, other) for other in counted):
+            counted.append(array)
+    return sum(array.nbytes for array in counted)
+
+
+def vector_memory(analyzer):
+    '''
+    @return: {"vocab_bytes": int, "corpus_bytes": int},
+             进程内实际保留的词向量（utils.vocab_tables中各精度的矩阵和缩放系数，加上尚未释放的float32矩阵和模型的词向量）
+             以及该analyzer所有业务分类匹配句矩阵（含缩放系数）占用的字节数
+    '''
+    utils.vocab_table(analyzer.precision)
+    arrays = [array for table in utils.vocab_tables.values() for array in table if array is not None]
+    if utils.vocab_matrix is not None:
+        arrays.append(utils.vocab_matrix)
+    if utils.word2vec_model is not None:
+        arrays.append(np.asarray(utils.word2vec_model.wv.vectors))
+    vocab_bytes = unique_nbytes(arrays)
+    corpus_bytes = 0
+    for state in analyzer.topics.values():
+        index = state.vector_index
+        corpus_bytes += index.matrix.nbytes + (index.scales.nbytes if index.scales is not None else 0)
+    return {"vocab_bytes": vocab_bytes, "corpus_bytes": corpus_bytes}
+
+
+def word2vec_decisions(analyzer, dialogs):
+    '''
+    @return: [(keypoint or None, score or None)], 每个句子word2vec方法的匹配结果
+    '''
+    decisions = []
+    for dialog in dialogs:
+        for item in dialog["transcripts"]:
+            result = analyzer.get_similarity(dialog["topic"], 'word2vec', item["speech"])
+            decisions.append((None, None) if result is None else (result['keypoint'], result['score']))
+    return decisions
+
+
+def quantization_report(compare_corpus, dialogs, make_model):
+    '''
+    float32与int8的内存和匹配结果对比：每种精度都重新set_model，相当于只用这一种精度的进程，
+    内存为进程内实际保留的词向量和匹配句矩阵；注意结束后进程内的模型为最后一次set_model的结果，只有int8词向量矩阵
+    @param dialogs: 验证集，synthetic_dialogs的结果
+    @param make_model: 无参数的函数，返回新的词向量模型，不保留模型的其他引用
+    @return: {"float32": {"vocab_bytes": int, "corpus_bytes": int, "ms_per_dialog": float},
+              "int8": {...},
+              "saved_bytes": int,
+              "keypoint_changed": float,  # word2vec方法下匹配到的关键点（或是否匹配到）变化的句子比例
+              "mean_score_shift": float,  # 关键点不变的句子分值变化的平均绝对值
+              "same_dialog_result": float}  # test结果完全一致的对话比例
+    '''
+    report = {}
+    decisions = {}
+    results = {}
+    for precision in ['float32', 'int8']:
+        utils.set_model(make_model())
+        analyzer = KeyPointAnalyzer(compare_corpus=compare_corpus, cache_size=0, precision=precision)
+        decisions[precision] = word2vec_decisions(analyzer, dialogs)
+        t = time.time()
+        results[precision] = [analyzer.analyze_dialog(dialog) for dialog in copy.deepcopy(dialogs)]
+        report[precision] = vector_memory(analyzer)
+        report[precision]["ms_per_dialog"] = (time.time() - t) * 1000 / len(dialogs)
+    report["saved_bytes"] = (report["float32"]["vocab_bytes"] + report["float32"]["corpus_bytes"]
+                             - report["int8"]["vocab_bytes"] - report["int8"]["corpus_bytes"])
+    changed = 0
+    shifts = []
+    for (keypoint, score), (keypoint_int8, score_int8) in zip(decisions["float32"], decisions["int8"]):
+        if keypoint != keypoint_int8:
+            changed += 1
+        elif score is not None:
+            shifts.append(abs(score - score_int8))
+    report["keypoint_changed"] = float(changed) / len(decisions["float32"])
+    report["mean_score_shift"] = float(np.mean(shifts)) if shifts else 0.0
+    report["same_dialog_result"] = float(sum(a == b for a, b in zip(results["float32"], results["int8"]))) / len(dialogs)
+    return report
+
+
+if __name__ == '__main__':
+    # python benchmark.py [--stand-in]，没有model/word2vec_include.model时自动使用小词向量模型
+    with open('data/compare_corpus_20.json', 'r', encoding='utf8') as f:
+        compare_corpus = json.load(f)
+    if '--stand-in' in sys.argv or not os.path.exists(utils.model_path):
+        corpus_sentences = [sentence for topic in compare_corpus.values()
+                            for keypoint in topic.values() for sentence in keypoint["compared_corpus"]]
+        make_model = lambda: StandInWord2Vec(corpus_sentences + CUSTOMER_PHRASES + [FILLER])
+        utils.set_model(make_model())
+    else:
+        make_model = lambda: utils.Word2Vec.load(utils.model_path)
+    key_point = KeyPointAnalyzer(compare_corpus=compare_corpus, cache_size=0)
+    topic = '现金分期'
+    for count, turns in [(20, 10), (50, 40), (50, 160)]:
+        dialogs = synthetic_dialogs(compare_corpus, topic, count=count, turns=turns)
+        for method, stats in benchmark_dialogs(key_point, dialogs).items():
+            print("%d个对话 x %d句, %s:" % (count, turns, method),
+                  ", ".join("%s=%.2f" % (name, value) for name, value in stats.items()))
+    for min_length in [100, 200, 400]:
+        utterances = long_utterances(compare_corpus, topic, count=50, min_length=min_length)
+        print("levenshtein 滑窗 vs 子串对齐, 句长>=%d:" % min_length,
+              benchmark_levenshtein_modes(key_point, topic, utterances))
+    large_topic = synthetic_topic(compare_corpus, keypoints=500, sentences_per_keypoint=40)
+    keypoint_vectors = {keypoint: utils.getsimlist_vec(large_topic[keypoint]["compared_corpus"]) for keypoint in large_topic}
+    vector_index = TopicVectorIndex(large_topic.keys(), keypoint_vectors,
+                                    {keypoint: large_topic[keypoint]["threshold"]["word2vec"] for keypoint in large_topic})
+    rnd = random.Random(1)
+    queries = [add_noise(rnd.choice(large_topic[keypoint]["compared_corpus"]), rnd, 0.1)
+               for keypoint in rnd.sample(list(large_topic), 200)]
+    for name, stats in benchmark_ivf(vector_index, queries, [{"nlist": 140, "nprobe": nprobe}
+                                                             for nprobe in [1, 4, 16, 140]]).items():
+        print("word2vec %d句匹配库, %s:" % (len(vector_index.sentences), name),
+              ", ".join("%s=%.3f" % (key, value) for key, value in stats.items()))
+    # 最后运行：每种精度重新set_model，结束后进程内只有int8词向量矩阵
+    print("float32 vs int8:", quantization_report(compare_corpus, synthetic_dialogs(compare_corpus, topic, count=50, turns=40),
+                                                  make_model))
@@ -0,0 +1,112 @@
+'''
+匹配库索引的磁盘缓存：每个业务分类的向量索引和levenshtein字符倒排索引中的数组各存成一个.npy文件，
+其余属性存在meta.json中；加载时数组以内存映射方式打开，多个进程共享同一份页缓存，启动时不需要重新向量化
+索引目录按匹配库和词向量模型的版本号命名，任一变化时找不到对应目录，重新构建
+'''
+import json
+import os
+import shutil
+import hashlib
+import numpy as np
+from utils import corpus_hash, model_fingerprint
+from vector_index import TopicVectorIndex
+from levenshtein_index import TopicLevenshteinIndex
+
+INDEX_FORMAT = 3  # 索引文件格式变化时加1，旧的索引目录不再使用
+INDEX_CLASSES = [("vector_index", TopicVectorIndex), ("levenshtein_index", TopicLevenshteinIndex)]
+
+
+def index_key(compare_corpus, precision='float32'):
+    '''
+    @param compare_corpus: 匹配库
+    @param precision: str, 匹配库向量矩阵的精度
+    @return: str, 匹配库、词向量模型、矩阵精度和文件格式共同决定的md5；
+             词向量模型的版本号未知（模型文件不存在）时返回None，不使用磁盘缓存
+    '''
+    fingerprint = model_fingerprint()
+    if fingerprint is None:
+        return None
+    dumped = json.dumps([INDEX_FORMAT, corpus_hash(compare_corpus), fingerprint, precision])
+    return hashlib.md5(dumped.encode('utf-8')).hexdigest()
+
+
+def save_object(directory, name, obj):
+    '''
+    numpy数组属性存成 name.属性.npy，其余属性返回，由调用方写入meta.json
+    @return: {"arrays": [属性], "values": {属性: 值}}
+    '''
+    meta = {"arrays": [], "values": {}}
+    for attr, value in obj.__dict__.items():
+        if isinstance(value, np.ndarray):
+            np.save(os.path.join(directory, '%s.%s.npy' % (name, attr)), value)
+            meta["arrays"].append(attr)
+        else:
+            meta["values"][attr] = value
+    return meta
+
+
+def load_object(cls, directory, name, meta):
+    '''
+    save_object的逆操作，数组只读地映射到内存，不调用cls.__init__
+    '''
+    obj = cls.__new__(cls)
+    obj.__dict__.update(meta["values"])
+    for attr in meta["arrays"]:
+        setattr(obj, attr, np.load(os.path.join(directory, '%s.%s.npy' % (name, attr)), mmap_mode='r'))
+    return obj
+
+
+def save_indexes(index_dir, compare_corpus, topics, precision='float32'):
+    '''
+    保存所有业务分类的索引，先写入临时目录再改名，其他进程看不到写了一半的索引
+    @param index_dir: str, 索引根目录
+    @param compare_corpus: 匹配库
+    @param topics: {"业务名": TopicState}
+    @param precision: str, 匹配库向量矩阵的精度
+    @return: str, 本次保存的索引目录；词向量模型的版本号未知时不保存，返回None
+    '''
+    key = index_key(compare_corpus, precision)
+    if key is None:
+        return None
+    directory = os.path.join(index_dir, key)
+    if os.path.exists(directory):
+        return directory
+    temp = '%s.tmp%d' % (directory, os.getpid())
+    os.makedirs(temp)
+    meta = {"topics": []}
+    for topic_num, (topic, state) in enumerate(topics.items()):
+        item = {"topic": topic}
+        for name, cls in INDEX_CLASSES:
+            item[name] = save_object(temp, '%d.%s' % (topic_num, name), getattr(state, name))
+        meta["topics"].append(item)
+    with open(os.path.join(temp, 'meta.json'), 'w', encoding='utf8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+    try:
+        os.rename(temp, directory)
+    except OSError:  # 其他进程已经保存了同样的索引
+        shutil.rmtree(temp, ignore_errors=True)
+    return directory
+
+
+def load_indexes(index_dir, compare_corpus, precision='float32'):
+    '''
+    加载与匹配库、词向量模型、精度一致的索引
+    @return: {"业务名": {"vector_index": TopicVectorIndex, "levenshtein_index": TopicLevenshteinIndex}},
+             没有对应的索引（或词向量模型的版本号未知）时返回None
+    '''
+    key = index_key(compare_corpus, precision)
+    if key is None:
+        return None
+    directory = os.path.join(index_dir, key)
+    meta_path = os.path.join(directory, 'meta.json')
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, 'r', encoding='utf8') as f:
+        meta = json.load(f)
+    indexes = {}
+    for topic_num, item in enumerate(meta["topics"]):
+        indexes[item["topic"]] = {name: load_object(cls, directory, '%d.%s' % (topic_num, name), item[name])
+                                  for name, cls in INDEX_CLASSES}
+        levenshtein_index = indexes[item["topic"]]["levenshtein_index"]
+        levenshtein_index.stats = dict.fromkeys(levenshtein_index.stats, 0)  # 剪枝统计从0开始
+    return indexes
@@ -0,0 +1,106 @@
+'''
+word2vec方法的近似最近邻索引（IVF）：匹配句向量用球面k-means聚成nlist个簇，
+查询时只对与句子最相近的nprobe个簇中的匹配句打分；nprobe越大召回越高，nprobe=nlist时与精确打分一致
+'''
+import numpy as np
+from quantize import row_scores
+
+
+class TopicIVFIndex(object):
+    def __init__(self, vector_index, nlist=None, nprobe=8, iterations=10, seed=0):
+        """
+        在TopicVectorIndex的归一化矩阵上构建倒排簇
+        @param vector_index: TopicVectorIndex
+        @param nlist: int, 簇数，为None时取sqrt(匹配句数)
+        @param nprobe: int, 查询时打分的簇数
+        @param iterations: int, k-means迭代次数
+        @param seed: int, 初始簇中心的随机种子
+        """
+        self.vector_index = vector_index
+        rows = len(vector_index.sentences)
+        if nlist is None:
+            nlist = int(np.sqrt(rows))
+        self.nlist = max(1, min(nlist, rows))
+        self.nprobe = nprobe
+        matrix = np.asarray(vector_index.dense_matrix())
+        if not rows:
+            self.centroids = np.zeros((0, 0), dtype=np.float32)
+            self.order = np.zeros(0, dtype=np.int64)
+            self.cluster_start = np.zeros(1, dtype=np.int64)
+            self.matrix = matrix
+            self.scales = None
+            return
+        rnd = np.random.RandomState(seed)
+        centroids = matrix[rnd.choice(rows, self.nlist, replace=False)]
+        for i in range(iterations):
+            assign = np.argmax(matrix.dot(centroids.T), axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, matrix)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            nonempty = norms[:, 0] > 0  # 空簇保留原来的中心
+            centroids[nonempty] = sums[nonempty] / norms[nonempty]
+        assign = np.argmax(matrix.dot(centroids.T), axis=1)
+        self.centroids = centroids
+        # 按簇重排矩阵，每个簇是连续的一段，查询时不需要按行号取行
+        self.order = np.argsort(assign, kind='stable')
+        self.cluster_start = np.searchsorted(assign[self.order], np.arange(self.nlist + 1))
+        if vector_index.scales is None:
+            self.matrix = matrix[self.order]
+            self.scales = None
+        else:  # int8时直接重排量化后的矩阵
+            self.matrix = np.asarray(vector_index.matrix)[self.order]
+            self.scales = np.asarray(vector_index.scales)[self.order]
+
+    def candidates(self, vec):
+        """
+        与句子最相近的nprobe个簇中的匹配句及其分值
+        @param vec: np.array([]), 归一化的句子向量
+        @return rows: np.array([]), 匹配句在vector_index中的行号（升序）
+        @return scores: np.array([]), 对应的余弦相似度
+        """
+        nprobe = min(self.nprobe, self.nlist)
+        centroid_scores = self.centroids.dot(vec)
+        if nprobe < self.nlist:
+            probed = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        else:
+            probed = np.arange(self.nlist)
+        rows = []
+        scores = []
+        for cluster in probed:
+            start, end = self.cluster_start[cluster], self.cluster_start[cluster + 1]
+            rows.append(self.order[start:end])
+            scores.append(row_scores(self.matrix[start:end], None if self.scales is None else self.scales[start:end], vec))
+        rows = np.concatenate(rows)
+        scores = np.concatenate(scores)
+        ascending = np.argsort(rows, kind='stable')
+        return rows[ascending], scores[ascending]
+
+    def match(self, sentence, sentence_vec):
+        """
+        与TopicVectorIndex.match的结果格式一致，只在候选簇的匹配句中取每个关键点的最高分
+        @param sentence: str, 原子句
+        @param sentence_vec: np.array([]), 子句向量
+        @return: list, 按关键点顺序 [{'sentence': '', 'keypoint': '', 'score': 0.93, 'compared_source': '', 'regex': ''}]
+        """
+        index = self.vector_index
+        vec = np.asarray(sentence_vec, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        if norm == 0 or self.nprobe >= self.nlist:  # 零向量所有分值为0，nprobe覆盖所有簇时直接走精确打分
+            return index.match(sentence, sentence_vec)
+        rows, scores = self.candidates(vec / norm)
+        row_keypoint = index.row_keypoint[rows]
+        segment_start = np.flatnonzero(np.concatenate(([True], row_keypoint[1:] != row_keypoint[:-1])))
+        segment_max = np.maximum.reduceat(scores, segment_start)
+        segment_keypoint = row_keypoint[segment_start]
+        passed = np.nonzero(segment_max > index.thresholds[segment_keypoint])[0]
+        result = []
+        for segment in passed:
+            start = segment_start[segment]
+            end = segment_start[segment + 1] if segment + 1 < len(segment_start) else len(scores)
+            row = rows[start + int(np.argmax(scores[start:end]))]
+            result.append({'sentence': sentence,  # 原子句
+                           'keypoint': index.keypoints[segment_keypoint[segment]],
+                           'score': float(segment_max[segment]),  # 相似度分值
+                           'compared_source': index.sentences[row],  # 匹配库中的句子
+                           'regex': ''})
+        return result
@@ -3,12 +3,26 @@ created by xuhong 2018/9/18
 '''
 import json
 import copy
+import multiprocessing
+import sys
+import threading
 import time
 from utils import *
+sys.path.append("..")
+from common.prefetch import prefetch
+from match_cache import MatchCache, MISS
+from topic_state import TopicState
+from index_store import load_indexes, save_indexes
+from match_record import MatchRecord, combine_records, records_to_result
+from profiler import StageProfiler
+
+METHODS = ['regex', 'word2vec', 'levenshtein']  # 合并结果时的优先级，分数相同时取前面算法的结果
 
 
 class KeyPointAnalyzer(object):
-    def __init__(self, compare_corpus):
+    def __init__(self, compare_corpus, cache_size=100000, levenshtein_prefilter=True, levenshtein_mode='window',
+                 profile=False, index_dir=None, ivf=None, stop_score=None, time_budget=None, precision='float32',
+                 tokenize_processes=1):
         """
         初始化话术分析器，注意从keypoint_analyzer表中读取compare_corpus
         @param compare_corpus: 可参照data/compare_corpus_20.json格式
@@ -19,20 +33,61 @@ class KeyPointAnalyzer(object):
                      "patterns":[str]}
                 }
             }
+        @param cache_size: int, 单句匹配结果LRU缓存的大小，为0时不缓存
+        @param levenshtein_prefilter: bool, levenshtein方法是否先用长度和字符重合数剪枝，结果与逐句计算一致
+        @param levenshtein_mode: str, 'window': 滑窗切分子句后逐个匹配; 'alignment': 整句与每个匹配句做子串对齐，召回更高、更慢
+        @param profile: bool, 是否统计各阶段耗时，也可以只在 with self.profiling(): 内统计
+        @param index_dir: str, 可选，匹配库索引的磁盘缓存目录：有与匹配库和词向量模型一致的索引时直接内存映射加载，
+                          不再向量化匹配库，也不加载词向量模型（直到第一次向量化对话）；没有时构建并保存
+        @param ivf: dict, 可选，word2vec方法使用近似最近邻索引（ivf_index.py）{"nlist": 100, "nprobe": 8}，
+                    nprobe越大召回越高、越慢；为None时精确打分
+        @param stop_score: float, 可选，业务分类的每个关键点都有分值不低于stop_score的匹配（如regex的1）时不再匹配后面的句子
+        @param time_budget: float, 可选，单个对话的匹配时间上限（秒），超时后不再匹配后面的句子，返回已有的结果并标记truncated
+        @param precision: str, 'float32' or 'int8'，匹配库向量矩阵和词向量矩阵的精度，int8时按行量化，矩阵内存约为1/4，打分较慢；
+                          同一进程中同时有两种精度时词向量矩阵两份都保留，见utils.vocab_table
+        @param tokenize_processes: int, 批量向量化时未命中分词缓存的句子较多时分词的进程数
         """
         self.compare_corpus = compare_corpus
-        self.compare_corpus_vector = copy.deepcopy(self.compare_corpus)
-        for topic in self.compare_corpus_vector:
-                for keypoint in self.compare_corpus_vector[topic]:
-                    self.compare_corpus_vector[topic][keypoint]["compared_corpus"] = getsimlist_vec(self.compare_corpus[topic][keypoint]["compared_corpus"])
+        self.profiler = StageProfiler(enabled=profile)
+        self.corpus_version = corpus_hash(compare_corpus)  # 匹配库变化时版本号变化
+        self.match_cache = MatchCache(capacity=cache_size)
+        self.levenshtein_prefilter = levenshtein_prefilter
+        self.levenshtein_mode = levenshtein_mode
+        self.ivf = ivf
+        if precision not in PRECISIONS:
+            raise ValueError('不支持的精度%s' % precision)
+        self.precision = precision
+        self.tokenize_processes = tokenize_processes
+        self.stop_score = stop_score
+        self.time_budget = time_budget
+        self.skipped = {"early_stopped": 0, "truncated": 0, "utterances": 0, "windows": 0}  # 提前结束跳过的对话数和句子数
+        # {"业务名": TopicState}, 每个业务分类的匹配库、句子向量、归一化矩阵、预编译的正则和字符倒排索引
+        self.topics = {}
+        indexes = load_indexes(index_dir, compare_corpus, precision) if index_dir else None
+        if indexes is not None:
+            for topic in self.compare_corpus:
+                self.topics[topic] = TopicState(self.compare_corpus[topic], ivf=ivf, precision=precision, **indexes[topic])
+        else:
+            for topic in self.compare_corpus:
+                topic_corpus = self.compare_corpus[topic]
+                self.topics[topic] = TopicState(
+                    topic_corpus,
+                    {keypoint: getsimlist_vec(topic_corpus[keypoint]["compared_corpus"], precision)
+                     for keypoint in topic_corpus},
+                    ivf=ivf, precision=precision)
+            if index_dir:
+                save_indexes(index_dir, compare_corpus, self.topics, precision)
+        self.update_lock = threading.Lock()  # 匹配库的更新串行进行，读取不加锁
         print('******初始化完成******')
 
-    def get_similarity(self, topic, method, sentence):
+    def get_similarity(self, topic, method, sentence, sentence_vec=None, state=None):
         '''
         单句与匹配库匹配,返回高于每项设定的阈值的关键点的最高相似度,有多个关键点的取最高的
         :param topic: string, '现金分期'
         :param method: string, 'levenshtein' or 'word2vec' or 'regex'
         :param sentence: string
+        :param sentence_vec: np.array, 可选，word2vec方法下已经批量算好的句子向量，为None时单独计算
+        :param state: TopicState, 可选，对话开始时取出的该业务分类的匹配库，为None时取当前的
         :return result: {'sentence': "subsentence", # 原子句
                          'keypoint':'', 
                          'score':'',  # 相似度分值，regex方法下置为1
@@ -40,6 +95,12 @@ class KeyPointAnalyzer(object):
                          'regex':''  # regex匹配到的式子
                          }
         '''
+        if state is None:
+            state = self.topics[topic]
+        cache_key = (topic, method, sentence, state.version)
+        result = self.match_cache.get(cache_key)
+        if result is not MISS:
+            return result
         result = []
         keypoints_result = []
         # try:
@@ -47,32 +108,214 @@ class KeyPointAnalyzer(object):
         # except KeyError:
         #     print('******暂不支持该业务分类下的关键点提取！******')
         #     exit()
-        sim_corpus = self.compare_corpus[topic]
-        for key in sim_corpus.keys():
-            if method == 'levenshtein':
-                threshold = sim_corpus[key]['threshold']['levenshtein']
-                score_result = levenshteinStr(sentence, self.compare_corpus[topic][key]["compared_corpus"], threshold)
-                # score_result: 单关键点匹配结果
-            elif method == 'word2vec':
-                threshold = sim_corpus[key]['threshold']['word2vec']
-                score_result = w2v_model_new(sentence, self.compare_corpus_vector[topic][key]["compared_corpus"], threshold)
-            elif method == 'regex':
-                re_patterns = sim_corpus[key]['patterns']
-                score_result = regex(sentence, re_patterns)
-            else:
-                print('******暂不支持该方法！*******')
-            if score_result != None:
-                score_result['keypoint'] = key
-                score_result['score'] = float('%.2f' % score_result['score']) # 相似度分值取小数点后两位
-                keypoints_result.append(score_result)
+        sim_corpus = state.corpus
+        if method == 'word2vec':
+            # 一次矩阵乘法对整个业务分类打分，按关键点分段取最高分；有近似索引时只对最相近的几个簇打分
+            if sentence_vec is None:
+                sentence_vec = get_vec(sentence, self.precision)[1]
+            vector_index = state.ivf_index if state.ivf_index is not None else state.vector_index
+            keypoints_result = vector_index.match(sentence, sentence_vec)
+        elif method == 'regex':
+            # 预编译的正则，不包含任何pattern的句子扫描一遍即可排除
+            keypoints_result = state.regex_scanner.scan(sentence)
+        elif method == 'levenshtein' and self.levenshtein_prefilter:
+            # 长度和字符重合数得到的ratio上界达不到阈值的句子对直接跳过
+            keypoints_result = state.levenshtein_index.match(sentence)
+        else:
+            for key in sim_corpus.keys():
+                if method == 'levenshtein':
+                    threshold = sim_corpus[key]['threshold']['levenshtein']
+                    score_result = levenshteinStr(sentence, sim_corpus[key]["compared_corpus"], threshold)
+                    # score_result: 单关键点匹配结果
+                else:
+                    print('******暂不支持该方法！*******')
+                    score_result = None
+                if score_result != None:
+                    score_result['keypoint'] = key
+                    keypoints_result.append(score_result)
+        for score_result in keypoints_result:
+            score_result['score'] = float('%.2f' % score_result['score']) # 相似度分值取小数点后两位
         # print(keypoints_result)
         if len(keypoints_result) >= 1: # 子句匹配到多个关键点时，取相似度分值最高的
             result = top_keypoint(keypoints_result)
             result['sentence'] = sentence
         else:
             result = None
+        self.match_cache.put(cache_key, result)
         return result
 
+    def prefilter_stats(self):
+        '''
+        levenshtein剪枝统计
+        :return: {"pairs": int,  # 句子对总数
+                  "pruned_length": int,  # 长度上界剪掉的句子对
+                  "pruned_overlap": int,  # 字符重合数上界剪掉的句子对
+                  "computed": int}  # 实际计算Levenshtein.ratio的句子对
+        '''
+        stats = {"pairs": 0, "pruned_length": 0, "pruned_overlap": 0, "computed": 0}
+        for state in self.topics.values():
+            for key in stats:
+                stats[key] += state.levenshtein_index.stats[key]
+        return stats
+
+    def cache_stats(self):
+        '''
+        单句匹配结果缓存的命中统计
+        :return: {"hits": int, "misses": int, "hit_rate": float, "size": int, "capacity": int}
+        '''
+        return self.match_cache.stats()
+
+    def tokenizer_stats(self):
+        '''
+        分词缓存的命中统计（分词器为进程内共用）
+        :return: {"hits": int, "misses": int, "hit_rate": float, "size": int, "capacity": int}
+        '''
+        return tokenizer.stats()
+
+    def skip_stats(self):
+        '''
+        提前结束（stop_score）和超时（time_budget）的统计
+        :return: {"early_stopped": int,  # 提前结束的对话数（多业务分类时按每个业务分类计）
+                  "truncated": int,  # 超时的对话数（多业务分类时按每个业务分类计）
+                  "utterances": int,  # 跳过的句子数
+                  "windows": int}  # 跳过的levenshtein子句数
+        '''
+        return dict(self.skipped)
+
+    def profile_stats(self):
+        '''
+        各阶段耗时统计，只包含当前进程（processes>1时子进程的统计不汇总）
+        :return: {"stages": {阶段: {"calls": int, "seconds": float, "max_seconds": float, "items": int}},
+                  "topics": {业务名: {阶段: {...}}},
+                  "keypoints": {业务名: {关键点: {算法: {...}}}}}  # calls为匹配到该关键点的次数，seconds为这些匹配的耗时
+        '''
+        return self.profiler.snapshot()
+
+    def profiling(self, reset=True):
+        '''
+        在with内统计各阶段耗时: with key_point.profiling() as profiler: key_point.test(dialogs)，之后profiler.snapshot()
+        :param reset: bool, 进入时是否清空之前的统计
+        '''
+        return self.profiler.profile(reset=reset)
+
+    def embed(self, sentences):
+        '''
+        批量句子向量化，分别统计分词和向量化的耗时
+        :param sentences: list, ["", ""]
+        :return: np.array, 与get_vec_batch的vectors一致
+        '''
+        start = self.profiler.start()
+        ids, lengths = sentences_to_ids(sentences, self.tokenize_processes)
+        self.profiler.stop('tokenize', start, items=len(sentences))
+        start = self.profiler.start()
+        vectors = ids_to_vectors(ids, lengths, self.precision)[0]
+        self.profiler.stop('embed', start, items=len(sentences))
+        return vectors
+
+    def update_topic(self, topic, update):
+        '''
+        更新单个业务分类的匹配库：在该业务分类匹配库的拷贝上修改，只对新出现的匹配句向量化，
+        重建该业务分类的索引后整体替换，正在处理的对话仍使用旧的匹配库；关键点全部删除时删除该业务分类
+        :param topic: string, '现金分期'，不存在时新建
+        :param update: function(topic_corpus), 直接修改传入的匹配库拷贝 {"关键点1": {"compared_corpus": [], "threshold": {}, "patterns": []}}
+        '''
+        with self.update_lock:
+            old = self.topics.get(topic)
+            topic_corpus = copy.deepcopy(old.corpus) if old is not None else {}
+            update(topic_corpus)
+            known = old.sentence_vectors() if old is not None else {}  # 已经向量化的匹配句
+            new_sentences = [sentence for keypoint in topic_corpus for sentence in topic_corpus[keypoint]["compared_corpus"]
+                             if sentence not in known]
+            for item in getsimlist_vec(list(dict.fromkeys(new_sentences)), self.precision):
+                known[item["sentence"]] = item
+            keypoint_vectors = {keypoint: [known[sentence] for sentence in topic_corpus[keypoint]["compared_corpus"]
+                                           if sentence in known]
+                                for keypoint in topic_corpus}
+            topics = dict(self.topics)
+            compare_corpus = dict(self.compare_corpus)
+            if topic_corpus:
+                state = TopicState(topic_corpus, keypoint_vectors, ivf=self.ivf, precision=self.precision)
+                if old is not None:
+                    state.levenshtein_index.stats = old.levenshtein_index.stats  # 剪枝统计继续累计
+                topics[topic] = state
+                compare_corpus[topic] = topic_corpus
+            else:
+                topics.pop(topic, None)
+                compare_corpus.pop(topic, None)
+            self.topics = topics
+            self.compare_corpus = compare_corpus
+            self.corpus_version = corpus_hash(compare_corpus)
+
+    def save_index(self, index_dir):
+        '''
+        把当前的匹配库索引（包括update_topic等更新后的）保存到磁盘，下次用同样的匹配库初始化时直接加载
+        :param index_dir: str, 索引根目录
+        :return: str, 本次保存的索引目录
+        '''
+        return save_indexes(index_dir, self.compare_corpus, self.topics, self.precision)
+
+    def add_keypoint(self, topic, keypoint, compared_corpus, threshold, patterns=None):
+        '''
+        新增关键点，已存在时替换
+        :param topic: string, '现金分期'
+        :param keypoint: string, '确认业务'
+        :param compared_corpus: list, [str]
+        :param threshold: dict, {"levenshtein": 0.7, "word2vec": 0.9}
+        :param patterns: list, [str]
+        '''
+        def update(topic_corpus):
+            topic_corpus[keypoint] = {"compared_corpus": list(compared_corpus),
+                                      "threshold": dict(threshold),
+                                      "patterns": list(patterns or [])}
+        self.update_topic(topic, update)
+
+    def remove_keypoint(self, topic, keypoint):
+        def update(topic_corpus):
+            del topic_corpus[keypoint]
+        self.update_topic(topic, update)
+
+    def add_sentences(self, topic, keypoint, sentences):
+        '''
+        关键点新增匹配句，已有的匹配句不重复添加
+        :param sentences: list, [str]
+        '''
+        def update(topic_corpus):
+            compared_corpus = topic_corpus[keypoint]["compared_corpus"]
+            compared_corpus.extend(sentence for sentence in dict.fromkeys(sentences) if sentence not in compared_corpus)
+        self.update_topic(topic, update)
+
+    def remove_sentences(self, topic, keypoint, sentences):
+        '''
+        删除关键点的匹配句
+        :param sentences: list, [str]
+        '''
+        def update(topic_corpus):
+            removed = set(sentences)
+            topic_corpus[keypoint]["compared_corpus"] = [sentence for sentence in topic_corpus[keypoint]["compared_corpus"]
+                                                         if sentence not in removed]
+        self.update_topic(topic, update)
+
+    def set_threshold(self, topic, keypoint, levenshtein=None, word2vec=None):
+        '''
+        修改关键点的阈值，为None的不修改
+        '''
+        def update(topic_corpus):
+            threshold = topic_corpus[keypoint]["threshold"]
+            if levenshtein is not None:
+                threshold["levenshtein"] = levenshtein
+            if word2vec is not None:
+                threshold["word2vec"] = word2vec
+        self.update_topic(topic, update)
+
+    def set_patterns(self, topic, keypoint, patterns):
+        '''
+        替换关键点的正则表达式
+        :param patterns: list, [str]
+        '''
+        def update(topic_corpus):
+            topic_corpus[keypoint]["patterns"] = list(patterns)
+        self.update_topic(topic, update)
+
     def deal_dialog(self, dialog, topic, N, step):
         '''
         处理输入的一段对话
@@ -97,21 +340,29 @@ class KeyPointAnalyzer(object):
                 index_sentence[sen_num] = string
                 if not string:
                     sentence = None
-                if N > len(string):
-                    subsen = {'sentence': string, 'sen_num': each_pare["sen_num"], 'start_time': each_pare["start_time"],'end_time': each_pare["end_time"]}
+                for item in self.split_windows(string, N, step):
+                    subsen = {'sentence': item, 'sen_num': each_pare["sen_num"], 'start_time': each_pare["start_time"],'end_time': each_pare["end_time"]}
                     subsentence.append(subsen)
-                else:
-                    res = []
-                    point = N
-                    while point <= len(string):
-                        res.append(string[point - N: point])
-                        point = point + step
-                    for item in res:
-                        subsen = {'sentence': item, 'sen_num': each_pare["sen_num"], 'start_time': each_pare["start_time"],'end_time': each_pare["end_time"]}
-                        subsentence.append(subsen)
         return subsentence, index_sentence
 
-    def subsenlist_simi(self, subsentence_list, topic, method='levenshtein'):
+    def split_windows(self, string, N, step):
+        '''
+        滑动窗口：按照窗口大小N以步长step切分，句子短于N时不切分
+        :param string: string, '查一下信用卡额度'
+        :param N: int, 滑窗大小
+        :param step: int, 滑窗步长
+        :return: list, ['查一下信用卡', '一下信用卡额', '下信用卡额度']
+        '''
+        if N > len(string):
+            return [string]
+        res = []
+        point = N
+        while point <= len(string):
+            res.append(string[point - N: point])
+            point = point + step
+        return res
+
+    def subsenlist_simi(self, subsentence_list, topic, method='levenshtein', sentence_vecs=None):
         '''
         对子句list进行相似度匹配，返回每个子句对应的关键点以及该关键点的相似度分值
         :param subsentence_list: list, [{'sentence':subsentence1,
@@ -120,6 +371,7 @@ class KeyPointAnalyzer(object):
                                          'end_time':end_time},...]
         :param topic: string, '现金分期'
         :param method: string, 用到的算法，默认为levenshtein 可选'word2vec' or 're'
+        :param sentence_vecs: np.array, 可选，word2vec方法下与subsentence_list一一对应的句子向量
         :return result: list, [{'sentence': '', 
                                 'sen_num': 0, 
                                 'keypoint': '', 
@@ -130,10 +382,10 @@ class KeyPointAnalyzer(object):
                                 'end_time':end_time}, {}]
         '''
         result = []
-        for subsentence in subsentence_list:
+        for i, subsentence in enumerate(subsentence_list):
             sentence = subsentence['sentence']
             subsentence_result = self.get_similarity(
-                topic, method, sentence)
+                topic, method, sentence, None if sentence_vecs is None else sentence_vecs[i])
             if subsentence_result != None:
                 subsentence_result['sen_num'] = subsentence['sen_num']   # 加入源句，时间等信息
                 subsentence_result['start_time'] = subsentence['start_time']
@@ -188,7 +440,148 @@ class KeyPointAnalyzer(object):
         else:
             return result
 
-    def run_levenshtein(self, transcripts, topic):
+    def align(self, topic, sentence, state=None):
+        '''
+        整句与匹配库做子串对齐，返回所有高于阈值的关键点
+        :param topic: string, '现金分期'
+        :param sentence: string, 对话中的原句
+        :param state: TopicState, 可选，为None时取当前的
+        :return result: list, [{'sentence': '最佳子串', 'keypoint': '', 'score': 0.8, 'compared_source': '', 'regex': ''}]
+        '''
+        if state is None:
+            state = self.topics[topic]
+        result = state.levenshtein_index.align(sentence)
+        for score_result in result:
+            score_result['score'] = float('%.2f' % score_result['score']) # 相似度分值取小数点后两位
+        return result
+
+    def alignment_simi(self, subsentence_list, topic):
+        '''
+        子串对齐：对每个整句，在整句中找与每个匹配句ratio最高的子串，返回所有高于阈值的关键点
+        :param subsentence_list: list, [{'sentence': 整句, 'sen_num': num, 'start_time':start_time, 'end_time':end_time},...]
+        :param topic: string, '现金分期'
+        :return result: list, 与subsenlist_simi格式一致，'sentence'为最佳子串
+        '''
+        result = []
+        for subsentence in subsentence_list:
+            for score_result in self.align(topic, subsentence['sentence']):
+                score_result['sen_num'] = subsentence['sen_num']
+                score_result['start_time'] = subsentence['start_time']
+                score_result['end_time'] = subsentence['end_time']
+                result.append(score_result)
+        if result == []:
+            return None
+        else:
+            return result
+
+    def dialog_windows(self, transcripts):
+        '''
+        levenshtein滑窗模式下每个句子的滑窗子句，多个业务分类共用
+        :param transcripts: list, 对话
+        :return: list, 与transcripts一一对应，坐席的句子为滑窗子句list，客户的句子为None
+        '''
+        return [self.split_windows(item["speech"], 10, 3) if item['target'] == '坐席' else None for item in transcripts]
+
+    def skip_rest(self, progress, reason, transcripts, methods, mode):
+        '''
+        记录提前结束时跳过的句子
+        :param progress: dict, match_dialog的progress
+        :param reason: string, 'early_stopped' or 'truncated'
+        :param transcripts: list, 跳过的句子
+        '''
+        windows = 0
+        if 'levenshtein' in methods:
+            for item in transcripts:
+                if item['target'] == '坐席':
+                    windows += 1 if mode == 'alignment' else len(self.split_windows(item["speech"], 10, 3))
+        progress[reason] = True
+        progress["utterances"] += len(transcripts)
+        progress["windows"] += windows
+        self.skipped[reason] += 1
+        self.skipped["utterances"] += len(transcripts)
+        self.skipped["windows"] += windows
+
+    def match_dialog(self, transcripts, topic, methods=METHODS, sentence_vecs=None, levenshtein_mode=None, state=None,
+                     windows=None, stop_score=None, deadline=None, progress=None):
+        '''
+        融合引擎：只遍历一遍对话，每个句子依次做各算法的匹配，结果直接写入按算法、关键点累积的结果
+        regex和word2vec对每个整句匹配；levenshtein只对坐席的句子，按滑窗子句匹配或整句做子串对齐
+        :param transcripts: list, [{"target": "坐席", "speech": "", "start_time": "0.00", "end_time": "3.83"}]
+        :param topic: string, '现金分期'
+        :param methods: list, 用到的算法
+        :param sentence_vecs: np.array, 可选，与transcripts一一对应的句子向量，为None时整段对话一次批量向量化
+        :param levenshtein_mode: string, 'window' or 'alignment'，为None时使用初始化时的levenshtein_mode
+        :param state: TopicState, 可选，为None时取当前的；整段对话使用同一个匹配库，不受匹配库更新影响
+        :param windows: list, 可选，dialog_windows的结果，为None时逐句切分
+        :param stop_score: float, 可选，每个关键点都有分值不低于stop_score的匹配时不再匹配后面的句子
+        :param deadline: float, 可选，time.perf_counter()的截止时间，超过后不再匹配后面的句子
+        :param progress: dict, 可选，提前结束时记录 {"early_stopped": bool, "truncated": bool, "utterances": 跳过的句子数, "windows": 跳过的levenshtein子句数}
+        :return accumulator: dict, {method: {keypoint: [MatchRecord]}}, MatchRecord只记源句序号，由records_to_result转换成结果格式
+        '''
+        accumulator = {method: {} for method in methods}
+        if not transcripts:
+            return accumulator
+        if state is None:
+            state = self.topics[topic]
+        if 'levenshtein' in methods and 'sen_num' not in transcripts[0].keys():  # 与deal_dialog一致，自动标注句子序号
+            for i in range(len(transcripts)):
+                transcripts[i]['sen_num'] = i
+        if 'word2vec' in methods and sentence_vecs is None:
+            sentence_vecs = self.embed([item["speech"] for item in transcripts])
+        mode = levenshtein_mode or self.levenshtein_mode
+        profiler = self.profiler
+        if progress is None:
+            progress = {"early_stopped": False, "truncated": False, "utterances": 0, "windows": 0}
+        satisfied = set()  # 已有分值不低于stop_score的匹配的关键点
+        for i, item in enumerate(transcripts):
+            if deadline is not None and time.perf_counter() > deadline:
+                self.skip_rest(progress, 'truncated', transcripts[i:], methods, mode)
+                break
+            speech = item["speech"]
+            for method in methods:
+                start = profiler.start()
+                items = 1
+                if method == 'levenshtein':
+                    if item['target'] != '坐席':
+                        continue
+                    if mode == 'alignment':
+                        matches = self.align(topic, speech, state)
+                    else:  # 滑窗大小N=10，滑窗步长step=3
+                        speech_windows = self.split_windows(speech, 10, 3) if windows is None else windows[i]
+                        items = len(speech_windows)
+                        matches = [self.get_similarity(topic, method, window, state=state) for window in speech_windows]
+                elif method == 'word2vec':
+                    matches = [self.get_similarity(topic, method, speech, sentence_vecs[i], state)]
+                else:
+                    matches = [self.get_similarity(topic, method, speech, state=state)]
+                seconds = profiler.stop(method, start, items=items, topic=topic)
+                for match in matches:
+                    if match is None:
+                        continue
+                    profiler.keypoint(topic, match['keypoint'], method, seconds)
+                    accumulator[method].setdefault(match['keypoint'], []).append(MatchRecord.from_match(i, match))
+                    if stop_score is not None and match['score'] >= stop_score:
+                        satisfied.add(match['keypoint'])
+            if stop_score is not None and len(satisfied) >= len(state.corpus) and i + 1 < len(transcripts):
+                self.skip_rest(progress, 'early_stopped', transcripts[i + 1:], methods, mode)
+                break
+        return accumulator
+
+    def combine_accumulator(self, accumulator, transcripts):
+        '''
+        合并融合引擎各算法的结果，与combine_result一致：关键点按regex、word2vec、levenshtein的顺序出现，
+        同一关键点下来自于同一源句的取分值最高的一个，分值相同时取前面算法的结果
+        :param accumulator: dict, match_dialog的结果
+        :param transcripts: list, 对话
+        :return: list, [(keypoint, [MatchRecord])]
+        '''
+        combine_result_dict = {}
+        for method in METHODS:
+            for keypoint, records in accumulator.get(method, {}).items():
+                combine_result_dict.setdefault(keypoint, []).extend(records)
+        return [(keypoint, combine_records(records, transcripts)) for keypoint, records in combine_result_dict.items()]
+
+    def run_levenshtein(self, transcripts, topic, mode=None):
         '''
         对某个业务分类下的单个对话，获取关键点及对应的句子.如果没有检测到任何关键点，返回一个空[]
         :param  transcripts: list,每一项为一个句子
@@ -201,6 +594,7 @@ class KeyPointAnalyzer(object):
                                 },,,,
                             ]
         :param  topic:  string，业务分类，示例：'现金分期'
+        :param  mode:  string，'window' or 'alignment'，为None时使用初始化时的levenshtein_mode
         :return result: list, 每一项为这段话匹配到的关键点之一，
                         格式： [{'keypoint': '11.确认卡片是否在手', 
                                 'matched': [{'sentence': '',  # 匹配到的原句中的句子
@@ -213,19 +607,13 @@ class KeyPointAnalyzer(object):
                                             }]
                                 },,,] 
         '''
-        subsentence_list, index_sentence = self.deal_dialog(
-            transcripts, topic, 10, 3)  # 分句 滑窗大小N=10，滑窗步长step=3
-        dialog_result = self.subsenlist_simi(
-            subsentence_list, topic, method="levenshtein")  # 对分句结果list获取匹配结果
-        result = self.result_format(
-            sentence_result=dialog_result, source_index=index_sentence)
-        if result != []: # 同一源句合并
-            for index in range(len(result)):
-                matched = result[index]['matched']
-                result[index]['matched'] = combine(matched)
-        return result
+        accumulator = self.match_dialog(transcripts, topic, methods=['levenshtein'], levenshtein_mode=mode)
+        # 同一源句合并
+        return records_to_result([(keypoint, combine_records(records, transcripts))
+                                  for keypoint, records in accumulator['levenshtein'].items()], transcripts)
 
-    def run_word2vec(self, transcripts, topic):
+
+    def run_word2vec(self, transcripts, topic, sentence_vecs=None):
         '''
         对某个业务分类下的单个对话，获取关键点及对应的句子.如果没有检测到任何关键点，返回一个空[]
         :param  transcripts: list,每一项为一个句子
@@ -238,6 +626,7 @@ class KeyPointAnalyzer(object):
                                 },,,,
                             ]
         :param  topic:  string，业务分类，示例：'现金分期'
+        :param  sentence_vecs: np.array, 可选，与transcripts一一对应的句子向量，为None时整段对话一次批量向量化
         :return result: list, 每一项为这段话匹配到的关键点之一，
                         格式：[
                                 {'keypoint':'',
@@ -255,24 +644,9 @@ class KeyPointAnalyzer(object):
                                 {},
                             ]
         '''
-        # subsentence_list, index_sentence = self.deal_dialog(
-        #     dialog, topic, 10, 3)  # 分句 滑窗大小N=10，滑窗步长step=3
-        # [{'sentence':subsentence1,'sen_num': num, 'start_time': str, "end_time": str}]
-        subsentence_list = []
-        index_sentence = {}  # {num: "source sentence"}
-        for i, item in enumerate(transcripts):
-            subsentence_list.append({
-                "sentence": item["speech"],
-                'sen_num': i,
-                "start_time": item['start_time'],
-                "end_time": item['end_time']
-            })
-            index_sentence[i] = item["speech"]
-        dialog_result = self.subsenlist_simi(
-            subsentence_list, topic, method="word2vec")  # 对分句结果list获取匹配结果
-        result = self.result_format(
-            sentence_result=dialog_result, source_index=index_sentence)
-        return result
+        accumulator = self.match_dialog(transcripts, topic, methods=['word2vec'], sentence_vecs=sentence_vecs)
+        return records_to_result(accumulator['word2vec'].items(), transcripts)
+
 
     def run_regex(self, transcripts, topic):
         '''
@@ -304,25 +678,9 @@ class KeyPointAnalyzer(object):
                                 {},
                             ]
         '''
+        accumulator = self.match_dialog(transcripts, topic, methods=['regex'])
+        return records_to_result(accumulator['regex'].items(), transcripts)
 
-        # subsentence_list, index_sentence = self.deal_dialog(
-        #     dialog, topic, 10, 3)  # 分句 滑窗大小N=10，滑窗步长step=3
-        # [{'sentence':subsentence1,'sen_num': num, 'start_time': str, "end_time": str}]
-        subsentence_list = []
-        index_sentence = {}  # {num: "source sentence"}
-        for i, item in enumerate(transcripts):
-            subsentence_list.append({
-                "sentence": item["speech"],
-                'sen_num': i,
-                "start_time": item['start_time'],
-                "end_time": item['end_time']
-            })
-            index_sentence[i] = item["speech"]
-        dialog_result = self.subsenlist_simi(
-            subsentence_list, topic, method="regex")  # 对分句结果list获取匹配结果
-        result = self.result_format(
-            sentence_result=dialog_result, source_index=index_sentence)
-        return result
 
     def transform_result_list_to_dict(self, from_format):
         '''
@@ -421,10 +779,130 @@ class KeyPointAnalyzer(object):
         return combine_result
 
 
-    def test(self, dialogs):
+    def analyze_dialog(self, dialog, sentence_vecs=None):
+        '''
+        测试单个对话，三种算法的结果合并
+        @param dialog : {"transcripts": [{},{}], "id": str, "topic":str}
+        @param sentence_vecs: np.array, 可选，与transcripts一一对应的句子向量
+        @return 没有匹配到关键点（且没有超时）时返回None，否则返回test结果中的一项 {"id": str, "matched": [], "transcripts": str(dumped)}
+        '''
+        transcripts = dialog["transcripts"]
+        topic = dialog["topic"]
+        state = self.topics[topic]  # 整段对话使用同一个匹配库
+        dialog_start = self.profiler.start()
+        progress = {"early_stopped": False, "truncated": False, "utterances": 0, "windows": 0}
+        # 遍历一遍对话得到三种算法的结果，直接合并
+        accumulator = self.match_dialog(transcripts, topic, sentence_vecs=sentence_vecs, state=state,
+                                        stop_score=self.stop_score, deadline=self.deadline(), progress=progress)
+        start = self.profiler.start()
+        combined = self.combine_accumulator(accumulator, transcripts)
+        self.profiler.stop('combine', start, topic=topic)
+        start = self.profiler.start()
+        result = records_to_result(combined, transcripts)
+        self.profiler.stop('result_format', start, topic=topic)
+        self.profiler.stop('dialog', dialog_start, items=len(transcripts), topic=topic)
+
+        if result == [] and not progress["truncated"]:  # 超时的对话即使没有匹配到关键点也返回，标记truncated
+            return None
+        return self.mark_skipped({
+            "id": dialog["id"],
+            "matched": result,
+            "transcripts": json.dumps(transcripts, ensure_ascii=False)
+        }, progress)
+
+    def deadline(self):
+        '''
+        :return: float, 按time_budget得到的本对话的截止时间，没有设置time_budget时为None
+        '''
+        if self.time_budget is None:
+            return None
+        return time.perf_counter() + self.time_budget
+
+    def mark_skipped(self, entry, progress):
+        '''
+        提前结束时在结果中标记，没有提前结束时结果格式不变
+        :param entry: dict, 单个对话的结果
+        :param progress: dict, match_dialog的progress
+        :return: entry, 提前结束时加上 "early_stopped": bool, "truncated": bool, "skipped": {"utterances": int, "windows": int}
+        '''
+        if progress["early_stopped"] or progress["truncated"]:
+            entry["early_stopped"] = progress["early_stopped"]
+            entry["truncated"] = progress["truncated"]
+            entry["skipped"] = {"utterances": progress["utterances"], "windows": progress["windows"]}
+        return entry
+
+    def analyze_dialog_all_topics(self, dialog, topics=None, best_only=False, sentence_vecs=None):
+        '''
+        对单个对话匹配所有（或指定的）业务分类：分词、向量化和滑窗切分只做一次，各业务分类共用
+        @param dialog : {"transcripts": [{},{}], "id": str}，不需要topic
+        @param topics: list, 可选，要匹配的业务分类，为None时匹配所有业务分类
+        @param best_only: bool, 是否只保留覆盖率（匹配到的关键点占该业务分类关键点的比例）最高的业务分类，
+                          覆盖率相同时取匹配到的关键点多的，再相同时取靠前的
+        @param sentence_vecs: np.array, 可选，与transcripts一一对应的句子向量
+        @return 没有匹配到关键点（且没有超时）时返回None，否则返回 {"id": str,
+                                                 "topics": [{"topic": str, "coverage": float, "matched": []}],  # matched与test结果一致
+                                                 "transcripts": str(dumped)}
+        '''
+        transcripts = dialog["transcripts"]
+        states = self.topics  # 整段对话使用同一份匹配库
+        if topics is None:
+            topics = list(states.keys())
+        if sentence_vecs is None:
+            sentence_vecs = self.embed([item["speech"] for item in transcripts])
+        windows = self.dialog_windows(transcripts)
+        deadline = self.deadline()  # 所有业务分类共用一个时间上限
+        progress = {"early_stopped": False, "truncated": False, "utterances": 0, "windows": 0}
+        topic_results = []
+        for topic in topics:
+            state = states[topic]
+            accumulator = self.match_dialog(transcripts, topic, sentence_vecs=sentence_vecs, state=state, windows=windows,
+                                            stop_score=self.stop_score, deadline=deadline, progress=progress)
+            result = records_to_result(self.combine_accumulator(accumulator, transcripts), transcripts)
+            if result == []:
+                continue
+            topic_results.append({"topic": topic,
+                                  "coverage": float(len(result)) / len(state.corpus),
+                                  "matched": result})
+        if topic_results == [] and not progress["truncated"]:
+            return None
+        if best_only and topic_results:
+            topic_results = [max(topic_results, key=lambda item: (item["coverage"], len(item["matched"])))]
+        return self.mark_skipped({
+            "id": dialog["id"],
+            "topics": topic_results,
+            "transcripts": json.dumps(transcripts, ensure_ascii=False)
+        }, progress)
+
+    def test_all_topics(self, dialogs, topics=None, best_only=False):
+        '''
+        测试多个对话，每个对话匹配所有（或指定的）业务分类，不需要对话的topic
+        @param dialogs : [{"transcripts": [{},{}], "id": str}]
+        @param topics: list, 可选，要匹配的业务分类，为None时匹配所有业务分类
+        @param best_only: bool, 每个对话是否只保留覆盖率最高的业务分类
+        @return 只返回matched到的对话，每一项与analyze_dialog_all_topics的结果一致
+        '''
+        if topics is not None:
+            for topic in topics:
+                if topic not in self.topics:
+                    return '暂不支持该业务分类下的关键点提取！'
+        matched = []
+        speeches = [item["speech"] for dialog in dialogs for item in dialog["transcripts"]]
+        all_vecs = self.embed(speeches)
+        offset = 0
+        for dialog in dialogs:
+            sentence_vecs = all_vecs[offset: offset + len(dialog["transcripts"])]
+            offset += len(dialog["transcripts"])
+            result = self.analyze_dialog_all_topics(dialog, topics=topics, best_only=best_only, sentence_vecs=sentence_vecs)
+            if result is not None:
+                matched.append(result)
+        return matched
+
+    def test(self, dialogs, processes=1, chunksize=1):
         '''
         测试多个对话 
         @param dialogs : [{"transcripts": [{},{}], "id": str, "topic":str}, {"transcripts": [{},{}], "id": str,"topic":str}]
+        @param processes: int, 进程数，大于1时把对话分发到进程池并行处理
+        @param chunksize: int, 并行时每次分发给一个进程的对话数，越小负载越均衡，单个耗时长的对话不会拖住整批
         @return 只返回matched到的对话,[{
             "id": str,
             "matched": [
@@ -445,28 +923,65 @@ class KeyPointAnalyzer(object):
             "transcripts": str(dumped)
             }]
         '''
+        for dialog in dialogs:
+            if dialog["topic"] not in self.topics:
+                return '暂不支持该业务分类下的关键点提取！'
+        if processes > 1:
+            return self.test_parallel(dialogs, processes=processes, chunksize=chunksize)
         matched = []
+        # 所有对话的句子一次批量向量化，再按对话切分
+        speeches = [item["speech"] for dialog in dialogs for item in dialog["transcripts"]]
+        all_vecs = self.embed(speeches)
+        offset = 0
         for dialog in dialogs:
-            id = dialog["id"]
-            transcripts = dialog["transcripts"]
-            topic = dialog["topic"]
-            if topic not in self.compare_corpus.keys():
-            	return '暂不支持该业务分类下的关键点提取！'
-            le_result = self.run_levenshtein(transcripts=transcripts, topic=topic)
-            regex_result = self.run_regex(transcripts=transcripts, topic=topic)
-            w2v_result = self.run_word2vec(transcripts=transcripts, topic=topic)
-            
-            # 合并算法结果
-            result = self.combine_result(le_result=le_result, regex_result=regex_result,word2vec_result=w2v_result)
-            
-            if result != []:
-                matched.append({
-                    "id": id,
-                    "matched": result,
-                    "transcripts": json.dumps(transcripts, ensure_ascii=False)
-                })
+            sentence_vecs = all_vecs[offset: offset + len(dialog["transcripts"])]
+            offset += len(dialog["transcripts"])
+            result = self.analyze_dialog(dialog, sentence_vecs=sentence_vecs)
+            if result is not None:
+                matched.append(result)
         return matched
 
+    def iter_test(self, dialog_iterable, prefetch_size=0):
+        '''
+        流式测试多个对话：逐个读取对话并逐个返回结果，不需要把所有对话和结果同时放在内存中
+        @param dialog_iterable: 任意可迭代对象（如数据库游标），每一项为 {"transcripts": [{},{}], "id": str, "topic":str}
+        @param prefetch_size: int, 后台线程预读的对话数，读取与分析重叠进行，为0时不预读
+        @return generator, 只返回matched到的对话，每一项与test结果中的一项一致；不支持的业务分类跳过
+        '''
+        for dialog in prefetch(dialog_iterable, prefetch_size):
+            if dialog["topic"] not in self.topics:
+                print('暂不支持该业务分类下的关键点提取！', dialog["id"])
+                continue
+            result = self.analyze_dialog(dialog)
+            if result is not None:
+                yield result
+
+    def test_parallel(self, dialogs, processes, chunksize=1):
+        '''
+        多进程测试多个对话，结果顺序与输入一致
+        进程池在模型和匹配库向量加载完成后fork，子进程以copy-on-write方式共享这些内存，不需要重新加载
+        @param dialogs : [{"transcripts": [{},{}], "id": str, "topic":str}]
+        @param processes: int, 进程数
+        @param chunksize: int, 每次分发给一个进程的对话数
+        @return 与test一致
+        '''
+        global _worker_analyzer
+        _worker_analyzer = self
+        vocab_table(self.precision)  # fork之前加载词向量模型并生成对应精度的词向量矩阵，子进程共享
+        try:
+            with multiprocessing.get_context("fork").Pool(processes=processes) as pool:
+                results = list(pool.imap(_analyze_dialog_worker, dialogs, chunksize=chunksize))
+        finally:
+            _worker_analyzer = None
+        return [result for result in results if result is not None]
+
+
+_worker_analyzer = None  # fork之前设置，子进程直接继承
+
+
+def _analyze_dialog_worker(dialog):
+    return _worker_analyzer.analyze_dialog(dialog)
+
 if __name__ == '__main__':
     # 加载匹配库
     with open('data/compare_corpus_20.json', 'r', encoding='utf8') as f:
@@ -0,0 +1,246 @@
+'''
+Levenshtein匹配的候选剪枝：Levenshtein.ratio = 2 * LCS / (len1 + len2)，
+LCS不超过两句话的字符重合数，也不超过较短句子的长度，上界达不到阈值的句子对不用计算
+'''
+import numpy as np
+import Levenshtein
+
+EPS = 1e-9  # 上界与阈值比较时留出浮点误差
+
+
+def substring_ratios(sentence_codes, lengths, substring_codes, widths, thresholds, pair_rows):
+    """
+    每个（匹配句, 起点）与从起点开始、长度不超过widths的所有子串的ratio，按子串的字逐列递推LCS（列内用cummax），
+    之后再怎么延长也达不到阈值、超不过同一匹配句已有最高分的句子对提前结束
+    @param sentence_codes: np.array, shape=(p, 匹配句最大长度)，补齐为-1
+    @param lengths: np.array, shape=(p,)，匹配句长度
+    @param substring_codes: np.array, shape=(p, widths.max())，从起点开始的字，补齐为-2
+    @param widths: np.array, shape=(p,)，子串的最大长度
+    @param thresholds: np.array, shape=(p,)，levenshtein阈值
+    @param pair_rows: np.array, shape=(p,)，所属的匹配句，同一匹配句的句子对共用最高分
+    @return best_ratio: np.array, shape=(p,)，每个句子对ratio最高的子串的ratio，提前结束的句子对为结束前的最高分
+    @return best_width: np.array, shape=(p,)，对应的子串长度，分值相同时取较短的
+    """
+    best_ratio = np.zeros(len(lengths))
+    best_width = np.zeros(len(lengths), dtype=np.int64)
+    row_best = np.zeros(pair_rows.max() + 1)
+    pairs = np.arange(len(lengths))
+    dp = np.zeros((len(lengths), sentence_codes.shape[1] + 1))  # dp[:, k]: 匹配句前k个字与当前子串的LCS
+    # 再延长时，匹配句前k个字之后的字全部匹配上也至少要多用 len - k 个字：ratio <= 2 (dp_k + len - k) / (2 len + d + 1 - k)
+    rest = lengths[:, None] - np.arange(sentence_codes.shape[1] + 1)
+    rest_length = np.where(rest >= 0, lengths[:, None] + 1 + rest, np.inf)  # 超出匹配句长度的k不计
+    substring_codes = substring_codes.T
+    for d in range(substring_codes.shape[0]):
+        eq = sentence_codes == substring_codes[d][:, None]
+        step = np.maximum(dp[:, 1:], dp[:, :-1] + eq)
+        np.maximum.accumulate(step, axis=1, out=dp[:, 1:])
+        ratio = 2.0 * dp[:, -1] / (lengths + d + 1)  # 超出widths的位置都是补齐的字，LCS不变，ratio一定更低
+        better = ratio > best_ratio[pairs]
+        best_ratio[pairs[better]] = ratio[better]
+        best_width[pairs[better]] = d + 1
+        if d % 4:  # 剪枝每隔几列做一次
+            continue
+        np.maximum.at(row_best, pair_rows, best_ratio[pairs])
+        bound = 2.0 * ((dp + rest) / (rest_length + d)).max(axis=1)
+        keep = (d + 1 < widths) & (bound > thresholds - EPS) & (bound >= row_best[pair_rows]) & (bound > best_ratio[pairs])
+        if not keep.all():
+            pairs, dp, sentence_codes, substring_codes = pairs[keep], dp[keep], sentence_codes[keep], substring_codes[:, keep]
+            lengths, widths, thresholds, pair_rows = lengths[keep], widths[keep], thresholds[keep], pair_rows[keep]
+            rest, rest_length = rest[keep], rest_length[keep]
+            if not len(pairs):
+                break
+    return best_ratio, best_width
+
+
+class TopicLevenshteinIndex(object):
+    def __init__(self, keypoints, keypoint_sentences, thresholds):
+        """
+        按业务分类构建匹配库句子的字符倒排索引（字符 × 句子的计数矩阵）
+        @param keypoints: list, 关键点顺序 ['确认业务', '选择期数']
+        @param keypoint_sentences: dict, {"确认业务": [str, str]}
+        @param thresholds: dict, levenshtein阈值 {"确认业务": 0.7}
+        """
+        self.keypoints = list(keypoints)
+        self.sentences = []
+        row_keypoint = []
+        row_threshold = []
+        for key_num, key in enumerate(self.keypoints):
+            for sentence in keypoint_sentences[key]:
+                self.sentences.append(sentence)
+                row_keypoint.append(key_num)
+                row_threshold.append(float(thresholds[key]))
+        self.row_keypoint = np.array(row_keypoint, dtype=np.int32)
+        self.row_threshold = np.array(row_threshold)
+        self.thresholds = [float(thresholds[key]) for key in self.keypoints]
+        self.lengths = np.array([len(sentence) for sentence in self.sentences])
+        self.char_index = {}  # {字符: 列号}
+        for sentence in self.sentences:
+            for char in sentence:
+                self.char_index.setdefault(char, len(self.char_index))
+        self.char_counts = np.zeros((len(self.sentences), len(self.char_index)), dtype=np.int32)
+        for row, sentence in enumerate(self.sentences):
+            for char in sentence:
+                self.char_counts[row, self.char_index[char]] += 1
+        self.stats = {"pairs": 0, "pruned_length": 0, "pruned_overlap": 0, "computed": 0}
+        # 子串对齐用：所有匹配句的字符编码拼接在一起，第row句为codes[segment_start[row]: segment_start[row] + lengths[row]]
+        self.segment_start = np.cumsum([0] + list(self.lengths[:-1])).astype(np.int64)
+        self.codes = np.array([ord(char) for sentence in self.sentences for char in sentence], dtype=np.int64)
+
+    def char_overlap(self, sentence):
+        """
+        句子与每一行匹配句的字符重合数（按字符计数取较小值求和）
+        @param sentence: str
+        @return: np.array([])
+        """
+        counts = {}
+        for char in sentence:
+            if char in self.char_index:
+                column = self.char_index[char]
+                counts[column] = counts.get(column, 0) + 1
+        if not counts:
+            return np.zeros(len(self.sentences), dtype=np.int64)
+        return np.minimum(self.char_counts[:, list(counts.keys())], list(counts.values())).sum(axis=1)
+
+    def upper_bound(self, sentence):
+        """
+        句子与每一行匹配句的Levenshtein.ratio上界
+        @param sentence: str
+        @return length_bound: np.array([]), 只用长度得到的上界 2 * min(len1, len2) / (len1 + len2)
+        @return overlap_bound: np.array([]), 用字符重合数得到的上界 2 * overlap / (len1 + len2)
+        """
+        lensum = len(sentence) + self.lengths
+        lensum = np.where(lensum == 0, 1, lensum)
+        length_bound = 2.0 * np.minimum(len(sentence), self.lengths) / lensum
+        overlap_bound = 2.0 * self.char_overlap(sentence) / lensum
+        if not sentence:  # 空句只与空的匹配句ratio为1
+            length_bound = overlap_bound = (self.lengths == 0).astype(float)
+        return length_bound, overlap_bound
+
+    def match(self, sentence):
+        """
+        与levenshteinStr逐个关键点计算的结果完全一致，只跳过上界达不到阈值的句子对
+        @param sentence: str, 原子句
+        @return: list, 按关键点顺序 [{'sentence': '', 'keypoint': '', 'score': 0.8, 'compared_source': '', 'regex': ''}]
+        """
+        result = []
+        if not len(self.sentences):
+            return result
+        length_bound, overlap_bound = self.upper_bound(sentence)
+        length_passed = length_bound > self.row_threshold - EPS
+        candidates = np.nonzero(overlap_bound > self.row_threshold - EPS)[0]
+        self.stats["pairs"] += len(self.sentences)
+        self.stats["pruned_length"] += len(self.sentences) - int(length_passed.sum())
+        self.stats["pruned_overlap"] += int(length_passed.sum()) - len(candidates)
+        current_key = -1
+        sim_temp_dict = {}
+        sim_temp = 0.0
+        for row in candidates:
+            key_num = self.row_keypoint[row]
+            if key_num != current_key:
+                if sim_temp_dict:
+                    result.append(sim_temp_dict)
+                current_key = key_num
+                sim_temp_dict = {}
+                sim_temp = self.thresholds[key_num]
+            if overlap_bound[row] <= sim_temp - EPS:  # 同一关键点下已经有更高的分值
+                self.stats["pruned_overlap"] += 1
+                continue
+            self.stats["computed"] += 1
+            score = Levenshtein.ratio(self.sentences[row], sentence)
+            if score > sim_temp:
+                sim_temp = score
+                sim_temp_dict = {'sentence': sentence,  # 原子句
+                                 'keypoint': self.keypoints[key_num],
+                                 'score': sim_temp,  # 相似度分值
+                                 'compared_source': self.sentences[row],  # 匹配库中的句子
+                                 'regex': ''}
+        if sim_temp_dict:
+            result.append(sim_temp_dict)
+        return result
+
+    def align(self, utterance):
+        """
+        子串对齐：对每个匹配句，在整句中找ratio最高的子串，代替滑窗切分
+        ratio最高的子串一定以匹配句中的字开头，长度不超过 2 * len(匹配句) / 阈值 - len(匹配句)（否则达不到阈值），
+        所以每个匹配句只需要从这些字的位置开始，用substring_ratios求该长度以内每个子串的ratio，取最高的
+        （分值相同取起点靠前、较短的子串）；结果与枚举所有子串调用Levenshtein.ratio一致。
+        要对每个起点分别递推，比滑窗模式慢（100字以上的长句约慢1.5~5倍，匹配句越长越慢），换来滑窗切不出的匹配
+        @param utterance: str, 对话中的原句（未切割）
+        @return: list, 按关键点顺序 [{'sentence': '最佳子串', 'keypoint': '', 'score': 0.8, 'compared_source': '', 'regex': ''}]
+        """
+        result = []
+        if not len(self.sentences) or not utterance:
+            return result
+        # 子串的ratio不超过 2 * overlap / (len + overlap)，达不到阈值的匹配句不参与对齐
+        overlap = self.char_overlap(utterance)
+        lensum = np.where(self.lengths + overlap == 0, 1, self.lengths + overlap)
+        candidates = np.nonzero(2.0 * overlap / lensum > self.row_threshold - EPS)[0]
+        candidates = candidates[self.lengths[candidates] > 0]
+        self.stats["pairs"] += len(self.sentences)
+        self.stats["pruned_overlap"] += len(self.sentences) - len(candidates)
+        if not len(candidates):
+            return result
+        self.stats["computed"] += len(candidates)
+        utterance_codes = np.array([ord(char) for char in utterance], dtype=np.int64)
+        lengths = self.lengths[candidates]
+        thresholds = self.row_threshold[candidates]
+        # 子串的最大长度：ratio <= 2 * len(匹配句) / (len(匹配句) + len(子串))，更长的子串达不到阈值
+        widths = np.full(len(candidates), len(utterance))
+        positive = thresholds - EPS > 0
+        limits = np.floor(2.0 * lengths[positive] / (thresholds[positive] - EPS)) - lengths[positive]
+        widths[positive] = np.minimum(widths[positive], limits)
+        # 整句中每个字在char_index中的列号，不在匹配库中的字为-1
+        columns = np.array([self.char_index.get(char, -1) for char in utterance], dtype=np.int64)
+        known = np.unique(columns[columns >= 0])
+        if not len(known):  # 没有共同的字，ratio都为0
+            return result
+        positions = np.where(columns >= 0, np.searchsorted(known, columns), -1)
+        counts = self.char_counts[candidates][:, known]
+        prefix = np.zeros((len(utterance) + 1, len(known)), dtype=np.int32)  # 整句前缀中每个字的出现次数
+        np.cumsum(positions[:, None] == np.arange(len(known)), axis=0, out=prefix[1:])
+        # 起点：整句中在该匹配句中出现的字；从起点开始最大长度以内的字符重合数的上界达不到阈值的起点不参与对齐
+        pair_num, pair_start = np.nonzero((counts[:, np.maximum(positions, 0)] > 0) & (positions >= 0))
+        pair_width = np.minimum(widths[pair_num], len(utterance) - pair_start)
+        window = prefix[pair_start + pair_width] - prefix[pair_start]
+        overlap = np.minimum(window, counts[pair_num]).sum(axis=1)
+        keep = 2.0 * overlap / (lengths[pair_num] + overlap) > thresholds[pair_num] - EPS
+        pair_num, pair_start, pair_width = pair_num[keep], pair_start[keep], pair_width[keep]
+        if not len(pair_num):
+            return result
+        pair_ratio = np.zeros(len(pair_num))
+        pair_best = np.zeros(len(pair_num), dtype=np.int64)  # ratio最高的子串长度
+        # 按匹配句长度分组，同一组补齐到相近的长度
+        groups = np.floor(np.log2(lengths[pair_num])).astype(np.int64)
+        for group in np.unique(groups):
+            pairs = np.nonzero(groups == group)[0]
+            nums, starts, group_widths = pair_num[pairs], pair_start[pairs], pair_width[pairs]
+            # 匹配句补齐为-1，子串超出最大长度的位置补齐为-2，互不相等，也不与任何字相等
+            offsets = np.arange(lengths[nums].max())
+            index = np.minimum(self.segment_start[candidates[nums]][:, None] + offsets, len(self.codes) - 1)
+            sentence_codes = np.where(offsets < lengths[nums][:, None], self.codes[index], -1)
+            offsets = np.arange(group_widths.max())
+            index = np.minimum(starts[:, None] + offsets, len(utterance) - 1)
+            substring_codes = np.where(offsets < group_widths[:, None], utterance_codes[index], -2)
+            pair_ratio[pairs], pair_best[pairs] = substring_ratios(sentence_codes, lengths[nums], substring_codes, group_widths,
+                                                                   thresholds[nums], nums)
+        best = {}  # {关键点序号: (score, row, substring)}，同一关键点取分值最高的，分值相同取靠前的匹配句
+        bounds = np.searchsorted(pair_num, np.arange(len(candidates) + 1))  # pair_num已按匹配句、起点排序
+        for num, row in enumerate(candidates):
+            if bounds[num] == bounds[num + 1]:
+                continue
+            pair = bounds[num] + int(np.argmax(pair_ratio[bounds[num]: bounds[num + 1]]))  # 分值相同时取起点靠前的
+            if pair_best[pair] == 0:
+                continue
+            substring = utterance[pair_start[pair]: pair_start[pair] + pair_best[pair]]
+            score = Levenshtein.ratio(self.sentences[row], substring)
+            key_num = self.row_keypoint[row]
+            if score > self.thresholds[key_num] and (key_num not in best or score > best[key_num][0]):
+                best[key_num] = (score, row, substring)
+        for key_num in sorted(best):
+            score, row, substring = best[key_num]
+            result.append({'sentence': substring,  # 最佳子串
+                           'keypoint': self.keypoints[key_num],
+                           'score': score,  # 相似度分值
+                           'compared_source': self.sentences[row],  # 匹配库中的句子
+                           'regex': ''})
+        return result
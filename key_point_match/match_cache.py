@@ -0,0 +1,64 @@
+'''
+单句关键点匹配结果的LRU缓存，跨对话复用坐席的重复话术；
+匹配库更新时test()可能仍在其他线程中运行，get/put加锁
+'''
+import threading
+from collections import OrderedDict
+
+MISS = object()  # 缓存未命中，与缓存的None（没有匹配到关键点）区分
+
+
+class MatchCache(object):
+    def __init__(self, capacity=100000):
+        """
+        @param capacity: int, 最多缓存的句子数，为0时不缓存
+        """
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()  # 读取后move_to_end之前，其他线程的put可能已把这一项淘汰
+
+    def get(self, key):
+        """
+        @param key: tuple, (topic, method, sentence, 该业务分类的匹配库版本号)
+        @return: 缓存的匹配结果的拷贝（dict或None），未命中返回MISS
+        """
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return MISS
+            self._data.move_to_end(key)
+            self.hits += 1
+        return None if value is None else dict(value)
+
+    def put(self, key, value):
+        """
+        @param key: tuple, (topic, method, sentence, 该业务分类的匹配库版本号)
+        @param value: dict or None, get_similarity的结果
+        """
+        if self.capacity <= 0:
+            return
+        value = None if value is None else dict(value)
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.capacity:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """
+        @return: {"hits": int, "misses": int, "hit_rate": float, "size": int, "capacity": int}
+        """
+        total = self.hits + self.misses
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": float(self.hits) / total if total else 0.0,
+                "size": len(self._data),
+                "capacity": self.capacity}
@@ -0,0 +1,67 @@
+'''
+紧凑的匹配结果：用__slots__代替每个匹配结果一个dict，源句只记序号，在接口返回时才转换成dict
+'''
+from utils import best_per_source
+
+
+class MatchRecord(object):
+    __slots__ = ('sen_index', 'sentence', 'score', 'compared_source', 'regex')
+
+    def __init__(self, sen_index, sentence, score, compared_source, regex):
+        """
+        @param sen_index: int, 源句在transcripts中的序号
+        @param sentence: str, 原句或子句
+        @param score: float, 相似度分值
+        @param compared_source: str, 匹配库中的句子
+        @param regex: str, 匹配的正则表达式
+        """
+        self.sen_index = sen_index
+        self.sentence = sentence
+        self.score = score
+        self.compared_source = compared_source
+        self.regex = regex
+
+    @classmethod
+    def from_match(cls, sen_index, match):
+        """
+        @param sen_index: int, 源句在transcripts中的序号
+        @param match: dict, get_similarity的结果 {'sentence': '', 'score': 0.8, 'compared_source': '', 'regex': ''}
+        """
+        return cls(sen_index, match['sentence'], match['score'], match['compared_source'], match['regex'])
+
+    def to_dict(self, transcripts):
+        """
+        转换成接口的结果格式
+        @param transcripts: list, 源句所在的对话
+        @return: {'sentence': '', 'score': 0.53, 'compared_source': '', 'regex': '', 'start_time': '0.00', 'end_time': '3.83', 'source_sentence': ''}
+        """
+        source = transcripts[self.sen_index]
+        return {'sentence': self.sentence,  # 原句或子句
+                'score': self.score,  # 相似度分值
+                'compared_source': self.compared_source,  # 匹配库中的句子
+                'regex': self.regex,  # 匹配的正则表达式
+                'start_time': source['start_time'],
+                'end_time': source['end_time'],
+                'source_sentence': source['speech']}  # 子句源句
+
+
+def combine_records(records, transcripts):
+    '''
+    与combine一致：来自于同一源句（按源句文本）的取分值最高的一个
+    @param records: [MatchRecord]
+    @param transcripts: list, 源句所在的对话
+    @return: [MatchRecord]
+    '''
+    order = best_per_source([transcripts[record.sen_index]['speech'] for record in records],
+                            [record.score for record in records])
+    return [records[index] for index in order]
+
+
+def records_to_result(keypoint_records, transcripts):
+    '''
+    @param keypoint_records: [(keypoint, [MatchRecord])]
+    @param transcripts: list, 源句所在的对话
+    @return: [{'keypoint': '', 'matched': [{}]}]
+    '''
+    return [{'keypoint': keypoint, 'matched': [record.to_dict(transcripts) for record in records]}
+            for keypoint, records in keypoint_records]
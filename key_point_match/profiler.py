@@ -0,0 +1,94 @@
+'''
+话术匹配各阶段的耗时统计：调用次数、累计耗时、最大耗时、处理的句子数
+关闭时start/stop直接返回，不计时
+'''
+import time
+from contextlib import contextmanager
+
+
+class StageProfiler(object):
+    def __init__(self, enabled=False):
+        """
+        @param enabled: bool, 是否计时
+        """
+        self.enabled = enabled
+        self.reset()
+
+    def reset(self):
+        self.stages = {}  # {阶段: [calls, seconds, max_seconds, items]}
+        self.topics = {}  # {业务名: {阶段: [...]}}
+        self.keypoints = {}  # {业务名: {关键点: {算法: [...]}}}
+
+    def start(self):
+        """
+        @return: float, 开始时间，关闭时为0
+        """
+        return time.perf_counter() if self.enabled else 0.0
+
+    def stop(self, stage, start, items=1, topic=None):
+        """
+        记录一次调用
+        @param stage: str, 阶段名，如 'tokenize', 'embed', 'regex', 'word2vec', 'levenshtein', 'combine', 'result_format'
+        @param start: float, start()的返回值
+        @param items: int, 本次处理的句子（或滑窗子句）数
+        @param topic: str, 业务名，为None时只记入总的统计
+        @return: float, 本次耗时，关闭时为0
+        """
+        if not self.enabled:
+            return 0.0
+        seconds = time.perf_counter() - start
+        add_record(self.stages, stage, seconds, items)
+        if topic is not None:
+            add_record(self.topics.setdefault(topic, {}), stage, seconds, items)
+        return seconds
+
+    def keypoint(self, topic, keypoint, method, seconds):
+        """
+        记录一次匹配到关键点，耗时为得到该结果的那次匹配的耗时
+        """
+        if not self.enabled:
+            return
+        add_record(self.keypoints.setdefault(topic, {}).setdefault(keypoint, {}), method, seconds, 1)
+
+    def snapshot(self):
+        """
+        @return: {"stages": {阶段: {"calls": int, "seconds": float, "max_seconds": float, "items": int}},
+                  "topics": {业务名: {阶段: {...}}},
+                  "keypoints": {业务名: {关键点: {算法: {...}}}}}  # calls为匹配到该关键点的次数
+        """
+        return {"stages": format_records(self.stages),
+                "topics": {topic: format_records(stages) for topic, stages in self.topics.items()},
+                "keypoints": {topic: {keypoint: format_records(methods) for keypoint, methods in keypoints.items()}
+                              for topic, keypoints in self.keypoints.items()}}
+
+    @contextmanager
+    def profile(self, reset=True):
+        """
+        在with内计时，退出后恢复原来的开关
+        @param reset: bool, 进入时是否清空之前的统计
+        """
+        enabled = self.enabled
+        if reset:
+            self.reset()
+        self.enabled = True
+        try:
+            yield self
+        finally:
+            self.enabled = enabled
+
+
+def add_record(records, name, seconds, items):
+    record = records.get(name)
+    if record is None:
+        records[name] = [1, seconds, seconds, items]
+        return
+    record[0] += 1
+    record[1] += seconds
+    if seconds > record[2]:
+        record[2] = seconds
+    record[3] += items
+
+
+def format_records(records):
+    return {name: {"calls": calls, "seconds": seconds, "max_seconds": max_seconds, "items": items}
+            for name, (calls, seconds, max_seconds, items) in records.items()}
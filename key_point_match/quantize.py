@@ -0,0 +1,50 @@
+'''
+词向量和匹配句向量的int8量化：每行一个float32的缩放系数，行 ≈ codes * scale
+'''
+import numpy as np
+
+PRECISIONS = ['float32', 'int8']
+
+
+def quantize_rows(matrix):
+    '''
+    按每行绝对值的最大值量化，保留向量的长度（词向量求平均时长度有意义）
+    @param matrix: np.array, shape=(n, d)
+    @return codes: np.array, int8, shape=(n, d)
+    @return scales: np.array, float32, shape=(n,)
+    '''
+    matrix = np.asarray(matrix, dtype=np.float32)
+    scales = np.abs(matrix).max(axis=1) / 127 if len(matrix) else np.zeros(0, dtype=np.float32)
+    scales = scales.astype(np.float32)
+    codes = np.rint(matrix / np.where(scales == 0, 1, scales)[:, None]).astype(np.int8)
+    return codes, scales
+
+
+def quantize_unit_rows(matrix):
+    '''
+    量化归一化后的行，缩放系数取 1 / ||codes||，还原后每行仍是单位向量，
+    与单位向量的点积就是还原后向量的余弦相似度，量化误差只影响方向不影响长度
+    @param matrix: np.array, shape=(n, d), 每行已归一化（或为零向量）
+    @return codes: np.array, int8
+    @return scales: np.array, float32
+    '''
+    codes = quantize_rows(matrix)[0]
+    norms = np.linalg.norm(codes.astype(np.float32), axis=1)
+    scales = np.where(norms == 0, 0, 1 / np.where(norms == 0, 1, norms)).astype(np.float32)
+    return codes, scales
+
+
+def dequantize(codes, scales):
+    '''
+    @return: np.array, float32, codes * scales
+    '''
+    return codes.astype(np.float32) * scales[:, None]
+
+
+def row_scores(matrix, scales, vec):
+    '''
+    矩阵每行与vec的点积，scales为None时matrix为float32，否则为int8的codes
+    '''
+    if scales is None:
+        return matrix.dot(vec)
+    return matrix.dot(vec) * scales
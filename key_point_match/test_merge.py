@@ -0,0 +1,74 @@
+'''
+combine、top_keypoint与原先基于排序和list.index的实现对照：随机输入下结果（包括分值相同时的取舍和顺序）完全一致
+python test_merge.py 或 python -m pytest test_merge.py
+'''
+import copy
+import random
+from utils import combine, top_keypoint
+
+
+def original_combine(matched):
+    """
+    原先的combine实现（原样保留），作为对照
+    """
+    score = [item['score'] for item in matched]
+    score_forindex = copy.deepcopy(score)
+    score.sort()
+    source_sentence_list = []
+    result = []
+    for i in range(len(score)):
+        index = score_forindex.index(score[len(score)-i-1])
+        if matched[index]['source_sentence'] not in source_sentence_list:
+            result.append(matched[index])
+            source_sentence_list.append(matched[index]['source_sentence'])
+            matched.remove(matched[index])
+            score_forindex.remove(score[len(score)-i-1])
+    return result
+
+
+def original_top_keypoint(keypoints):
+    '''
+    原先的top_keypoint实现（原样保留），作为对照
+    '''
+    keypoint_list = [item['keypoint'] for item in keypoints]
+    score = [item['score'] for item in keypoints]
+    score_forindex = copy.deepcopy(score)
+    score.sort()
+    index = score_forindex.index(score[-1])
+    top1_keypoint = keypoints[index]
+    return top1_keypoint
+
+
+def random_matched(rnd):
+    return [{'sentence': str(n),
+             'score': rnd.choice([0.7, 0.75, 0.8, 0.9, 1.0]),
+             'source_sentence': rnd.choice('abcde')} for n in range(rnd.randint(1, 30))]
+
+
+def test_combine(trials=2000, seed=0):
+    rnd = random.Random(seed)
+    for i in range(trials):
+        matched = random_matched(rnd)
+        assert combine(list(matched)) == original_combine(list(matched)), matched
+
+
+def test_combine_tied_with_taken_source():
+    matched = [{'sentence': '1', 'score': 0.9, 'source_sentence': 'a'},
+               {'sentence': '2', 'score': 0.8, 'source_sentence': 'a'},
+               {'sentence': '3', 'score': 0.8, 'source_sentence': 'b'}]
+    # 与原实现一致：0.8分的第一项源句已被选中，同一分值后面的b也不再选取
+    assert combine(list(matched)) == original_combine(list(matched)) == [matched[0]]
+
+
+def test_top_keypoint(trials=2000, seed=0):
+    rnd = random.Random(seed)
+    for i in range(trials):
+        keypoints = [{'keypoint': str(n), 'score': rnd.choice([0.7, 0.8, 0.9, 1.0])} for n in range(rnd.randint(1, 20))]
+        assert top_keypoint(keypoints) is original_top_keypoint(keypoints), keypoints
+
+
+if __name__ == '__main__':
+    test_combine()
+    test_combine_tied_with_taken_source()
+    test_top_keypoint()
+    print('ok')
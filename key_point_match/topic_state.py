@@ -0,0 +1,51 @@
+'''
+单个业务分类的匹配库及其索引，构建后不再修改：匹配库更新时构建新的TopicState整体替换，
+正在处理的对话继续使用旧的TopicState，结果前后一致
+'''
+import sys
+from utils import corpus_hash
+from vector_index import TopicVectorIndex
+from ivf_index import TopicIVFIndex
+from levenshtein_index import TopicLevenshteinIndex
+sys.path.append("..")
+from common.regex_scanner import RegexScanner
+
+
+class TopicState(object):
+    __slots__ = ('corpus', 'version', 'vector_index', 'ivf_index', 'regex_scanner', 'levenshtein_index')
+
+    def __init__(self, corpus, keypoint_vectors=None, vector_index=None, levenshtein_index=None, ivf=None,
+                 precision='float32'):
+        """
+        @param corpus: dict, 单个业务分类的匹配库 {"关键点1": {"compared_corpus": [str], "threshold": {}, "patterns": [str]}}
+        @param keypoint_vectors: dict, 每个关键点getsimlist_vec的结果 {"关键点1": [{"sentence": str, "array": np.array([])}]}，
+                                 只在没有传入vector_index时用于构建向量索引
+        @param vector_index: TopicVectorIndex, 可选，已经构建好（如从磁盘加载）的向量索引
+        @param levenshtein_index: TopicLevenshteinIndex, 可选，已经构建好的字符倒排索引
+        @param ivf: dict, 可选，TopicIVFIndex的参数 {"nlist": 100, "nprobe": 8}，为None时word2vec只做精确打分
+        @param precision: str, 'float32' or 'int8'，构建向量索引时矩阵的精度
+        """
+        self.corpus = corpus
+        self.version = corpus_hash(corpus)  # 该业务分类的匹配库变化时版本号变化，旧的缓存结果不再命中
+        if vector_index is None:
+            vector_index = TopicVectorIndex(
+                corpus.keys(), keypoint_vectors,
+                {keypoint: corpus[keypoint]["threshold"]["word2vec"] for keypoint in corpus},
+                precision=precision)
+        self.vector_index = vector_index
+        self.ivf_index = TopicIVFIndex(vector_index, **ivf) if ivf is not None else None
+        self.regex_scanner = RegexScanner([(keypoint, corpus[keypoint]["patterns"]) for keypoint in corpus])
+        if levenshtein_index is None:
+            levenshtein_index = TopicLevenshteinIndex(
+                corpus.keys(),
+                {keypoint: corpus[keypoint]["compared_corpus"] for keypoint in corpus},
+                {keypoint: corpus[keypoint]["threshold"]["levenshtein"] for keypoint in corpus})
+        self.levenshtein_index = levenshtein_index
+
+    def sentence_vectors(self):
+        """
+        已经向量化的匹配句（归一化后的向量），匹配库更新时复用
+        @return: {匹配句: {"sentence": str, "array": np.array([])}}
+        """
+        return {sentence: {"sentence": sentence, "array": array}
+                for sentence, array in zip(self.vector_index.sentences, self.vector_index.dense_matrix())}
@@ -1,17 +1,127 @@
-import json,copy,re
+import json,copy,re,hashlib,heapq,os,sys
 import Levenshtein
 import linecache
 from gensim.models import Word2Vec
 import numpy as np
 import jieba
 from scipy.spatial.distance import pdist
+from quantize import PRECISIONS, quantize_rows
+sys.path.append("..")
+from common.tokenizer import Tokenizer
 
 stopwords_path = "data/stopwords.txt"
 model_path= "model/word2vec_include.model"
-model_loaded= Word2Vec.load(model_path)
-wordvec_size = len(model_loaded['账单'])
-zero_pad = [0 for n in range(wordvec_size)]
-stopwordlist = [line.strip() for line in open(stopwords_path, 'r', encoding="utf-8")]
+tokenizer = Tokenizer(stopword_paths=[stopwords_path, "data/ChineseStopWords.txt"])  # 分词结果有LRU缓存
+stopwordlist = tokenizer.stopwords  # frozenset
+
+
+def set_model(model, version=None):
+    '''
+    设置词向量模型，并重建词表，之前各精度的词向量矩阵作废
+    @param model: gensim Word2Vec，或提供wv.index2word、wv.vectors的同等对象（如benchmark中的小模型）
+    @param version: str, 模型的版本号，为None时由model_fingerprint按词表和词向量计算
+    '''
+    global word2vec_model, model_loaded, model_version, model_file, wordvec_size, zero_pad, vocab_index, vocab_words, \
+        vocab_matrix, vocab_tables
+    model_version = version
+    model_file = None
+    vocab_words = model.wv.index2word
+    vocab_matrix = np.asarray(model.wv.vectors, dtype=np.float32)  # float32原始矩阵，只用int8的进程量化后释放
+    vocab_tables = {}  # {精度: (词向量矩阵, 每行的缩放系数)}, 只有用到的精度
+    wordvec_size = vocab_matrix.shape[1]
+    zero_pad = [0 for n in range(wordvec_size)]
+    vocab_index = {word: i for i, word in enumerate(vocab_words)}  # {词: 词向量矩阵行号}
+    word2vec_model = model
+    model_loaded = True
+
+def vocab_table(precision='float32'):
+    '''
+    按精度取词向量矩阵，第一次用到时生成并缓存：float32为模型的原始矩阵，int8按行量化。
+    进程中还没有用到float32时，生成int8矩阵后释放float32矩阵和模型，只用int8的进程只保留int8矩阵；
+    同时用到两种精度的进程两份矩阵都保留（先用int8时，float32矩阵从model_path重新读取）
+    @param precision: str, 'float32' or 'int8'
+    @return matrix: np.array, shape=(词表大小, wordvec_size)
+    @return scales: np.array, int8时每行的缩放系数，float32时为None
+    '''
+    if precision not in PRECISIONS:
+        raise ValueError('不支持的精度%s' % precision)
+    load_model()
+    tables = vocab_tables
+    if precision not in tables:
+        if precision == 'float32':
+            tables[precision] = (float32_matrix(), None)
+        else:
+            tables[precision] = quantize_rows(float32_matrix())
+            if 'float32' not in tables:
+                release_float32()
+    return tables[precision]
+
+def float32_matrix():
+    '''
+    @return: np.array, float32原始词向量矩阵，已释放时从model_path重新读取
+    '''
+    global vocab_matrix
+    if vocab_matrix is None:
+        if model_file is None:
+            raise ValueError('float32词向量矩阵已在量化为int8后释放，set_model设置的模型无法重新读取，需要重新调用set_model')
+        vocab_matrix = np.asarray(Word2Vec.load(model_file).wv.vectors, dtype=np.float32)
+    return vocab_matrix
+
+def release_float32():
+    '''
+    释放float32词向量矩阵和模型，释放前先确定按词向量计算的模型版本号
+    '''
+    global word2vec_model, vocab_matrix
+    model_fingerprint()
+    word2vec_model = None
+    vocab_matrix = None
+
+
+def file_fingerprint(path):
+    '''
+    按路径、大小和修改时间得到文件的版本号，不需要读取文件
+    @return: str, md5；文件不存在或无法读取时返回None
+    '''
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    dumped = json.dumps([os.path.abspath(path), stat.st_size, stat.st_mtime])
+    return hashlib.md5(dumped.encode('utf-8')).hexdigest()
+
+def load_model():
+    '''
+    第一次用到词向量时才加载模型，只用磁盘上的匹配库索引时不需要加载
+    '''
+    global model_file
+    if not model_loaded:
+        set_model(Word2Vec.load(model_path), version=file_fingerprint(model_path))
+        model_file = model_path
+
+def model_fingerprint():
+    '''
+    词向量模型的版本号：从model_path加载的模型（包括尚未加载的）为文件的版本号，
+    set_model设置的模型按维度、词表和抽样的词向量计算
+    @return: str, md5；尚未加载且模型文件不存在时返回None
+    '''
+    global model_version
+    if not model_loaded:
+        return file_fingerprint(model_path)
+    if model_version is None:
+        step = max(1, len(vocab_matrix) // 1000)
+        md5 = hashlib.md5(json.dumps([list(vocab_matrix.shape), vocab_words],
+                                     ensure_ascii=False).encode('utf-8'))
+        md5.update(np.ascontiguousarray(vocab_matrix[::step]).tobytes())
+        model_version = md5.hexdigest()
+    return model_version
+
+
+word2vec_model = None  # 只用int8的进程量化词向量矩阵后为None
+model_loaded = False  # set_model之后为True
+model_version = None
+model_file = None  # 从model_path加载时为model_path，用于重新读取已释放的float32矩阵
+if not os.path.exists(model_path):  # 没有模型文件时需要先调用set_model
+    print('******未找到词向量模型%s******' % model_path)
 
 
 def corpus(path):
@@ -24,6 +134,15 @@ def corpus(path):
         corpus = json.load(f)
     return corpus
 
+def corpus_hash(compare_corpus):
+    '''
+    匹配库的版本号，匹配库内容变化时随之变化
+    @param compare_corpus: {"业务名": {"关键点1": {}}}
+    @return: str, md5
+    '''
+    dumped = json.dumps(compare_corpus, sort_keys=True, ensure_ascii=False)
+    return hashlib.md5(dumped.encode('utf-8')).hexdigest()
+
 def data(path):
     '''
     读取过滤后的数据
@@ -94,13 +213,8 @@ def top_keypoint(keypoints):
     @param keypoints: list,[{'keypoint':'key1', 'score':0.2, 'compared_source':'sdd'}, {'keypoint':'key2', 'score':0.9, 'compared_source':'top1_compared_sentence'}, {'keypoint':'key3', 'score':0.6, 'compared_source':'top1_compared_sentence1'}]
     @return top1_keypoint:{'compared_source': 'top1_compared_sentence', 'keypoint': 'key2', 'score': 0.9}
     '''
-    keypoint_list = [item['keypoint'] for item in keypoints]
-    score = [item['score'] for item in keypoints]
-    score_forindex = copy.deepcopy(score)
-    score.sort()
-    index = score_forindex.index(score[-1])
-    top1_keypoint = keypoints[index]
-    return top1_keypoint
+    # 分值相同时取靠前的关键点
+    return max(keypoints, key=lambda item: item['score'])
 
 def w2v_model_new(sentence, simi_list, threshold):
     """
@@ -120,7 +234,7 @@ def w2v_model_new(sentence, simi_list, threshold):
         score = getscore(sentence_vec[1], eachsim['array'])
         if score > sim_temp:
             sim_temp = score
-            sim_temp_dict = {'sentence':  get_vec(sentence)[0], # 原子句
+            sim_temp_dict = {'sentence':  sentence, # 原子句
                              'score':sim_temp,  # 相似度分值
                              'compared_source':eachsim['sentence'], # 匹配库中的句子
                              'regex':''}
@@ -132,28 +246,79 @@ def w2v_model_new(sentence, simi_list, threshold):
         return sim_temp_dict
 
 
-def getsimlist_vec(list):
+def tokenize(sentence):
+    """
+    jieba分词并去掉停用词
+    @param sentence: str
+    @return: [str]
+    """
+    return list(tokenizer.cut(sentence))
+
+def sentences_to_ids(sentences, processes=1):
+    """
+    批量分词并通过词表映射为词向量矩阵的行号，未登录词记为-1
+    @param sentences: ["", ""]
+    @param processes: int, 未命中分词缓存的句子较多时分词的进程数
+    @return ids: np.array([]), 所有句子的词id拼接在一起
+    @return lengths: np.array([]), 每个句子的词数
+    """
+    load_model()
+    ids = []
+    lengths = []
+    for words in tokenizer.cut_batch(sentences, processes=processes):
+        lengths.append(len(words))
+        ids.extend(vocab_index.get(word, -1) for word in words)
+    return np.array(ids, dtype=np.int64), np.array(lengths, dtype=np.int64)
+
+def get_vec_batch(sentences, processes=1, precision='float32'):
+    """
+    批量句子向量化：按词id从词向量矩阵中取行，再按句子分段求平均，未登录词用mask去掉
+    @param sentences: ["", ""]
+    @param processes: int, 分词的进程数
+    @param precision: str, 使用的词向量矩阵的精度，见vocab_table
+    @return vectors: np.array, shape=(len(sentences), wordvec_size), 没有登录词的句子为零向量
+    @return counts: np.array([]), 每个句子的登录词数
+    """
+    ids, lengths = sentences_to_ids(sentences, processes)
+    return ids_to_vectors(ids, lengths, precision)
+
+def ids_to_vectors(ids, lengths, precision='float32'):
+    """
+    按sentences_to_ids的结果求句子向量
+    @param ids: np.array([]), 所有句子的词id拼接在一起，未登录词为-1
+    @param lengths: np.array([]), 每个句子的词数
+    @param precision: str, 使用的词向量矩阵的精度，见vocab_table
+    @return: 与get_vec_batch一致
+    """
+    matrix, scales = vocab_table(precision)
+    segment = np.repeat(np.arange(len(lengths)), lengths)
+    mask = ids >= 0
+    ids, segment = ids[mask], segment[mask]
+    counts = np.bincount(segment, minlength=len(lengths))
+    vectors = np.zeros((len(lengths), wordvec_size))
+    if len(ids):
+        nonempty = np.nonzero(counts)[0]
+        starts = np.concatenate(([0], np.cumsum(counts[nonempty])[:-1]))
+        rows = matrix[ids]
+        if scales is not None:
+            rows = rows * scales[ids][:, None]
+        sums = np.add.reduceat(rows, starts, axis=0, dtype=np.float64)
+        vectors[nonempty] = sums / counts[nonempty][:, None]
+    return vectors, counts
+
+def getsimlist_vec(list, precision='float32'):
     """
     匹配库向量化
     @param list: ["", ""]
+    @param precision: str, 使用的词向量矩阵的精度，见vocab_table
     @return: [{"sentence": str, "array": np.array([])}]
     """
+    vectors, counts = get_vec_batch(list, precision=precision)
     result = []
-    for eachsentence in list:
-        wordlist = jieba.cut(eachsentence)
-        wordlist = [word for word in wordlist if word not in stopwordlist]
-        count = 0
-        sum = zero_pad
-        for eachword in wordlist:
-            try:
-                temp = model_loaded[eachword]
-                count = count + 1
-            except KeyError:
-                temp = zero_pad
-            sum = np.array(sum) + np.array(temp)
+    for eachsentence, vector, count in zip(list, vectors, counts):
         if count == 0:
             continue
-        result.append({"sentence": eachsentence, "array": sum / count})
+        result.append({"sentence": eachsentence, "array": vector})
     return result
     
 def getscore(sentence_vec, sim_vec):
@@ -170,27 +335,16 @@ def getscore(sentence_vec, sim_vec):
     return 1 - score
 
 
-def get_vec(sentence):
-    s = jieba.cut(sentence)
-    s=[word for word in s if word not in stopwordlist] 
-    count = 0
-    sum = zero_pad
-
-    for eachword in s:
-        try:
-            temp = model_loaded[eachword]
-            count = count + 1
-        except KeyError:
-            temp = zero_pad
-        sum = np.array(sum) + np.array(temp)
+def get_vec(sentence, precision='float32'):
+    vectors, counts = get_vec_batch([sentence], precision=precision)
     x = {}
-    if count == 0:
+    if counts[0] == 0:
         x[0] = sentence
         x[1] = zero_pad
         return x
     else:
         x[0] = sentence
-        x[1] = sum / count
+        x[1] = vectors[0]
         return x
 
 def regex(sentence, keywords):
@@ -235,16 +389,33 @@ def combine(matched):
                       'source_sentence': ''  # 子句源句
                     },,,,] 
     """
-    score = [item['score'] for item in matched]
-    score_forindex = copy.deepcopy(score)
-    score.sort()
-    source_sentence_list = []
-    result = []
-    for i in range(len(score)):
-        index = score_forindex.index(score[len(score)-i-1])
-        if matched[index]['source_sentence'] not in source_sentence_list:
-            result.append(matched[index])
-            source_sentence_list.append(matched[index]['source_sentence'])
-            matched.remove(matched[index])
-            score_forindex.remove(score[len(score)-i-1])    
-    return result
+    order = best_per_source([item['source_sentence'] for item in matched], [item['score'] for item in matched])
+    return [matched[index] for index in order]
+
+def best_per_source(sources, scores):
+    """
+    与原先基于排序和list.index的combine一致：按分值从高到低依次选取，源句已被选中的不再选取；
+    同一分值的项按原顺序选取，遇到源句已被选中的一项后，该分值后面的项都不再选取。
+    用堆按(分值从高到低, 原顺序)依次弹出，弹出顺序与原先排序后逐个list.index查找的顺序相同，
+    所有源句都已选中时提前结束，不必弹出其余的项
+    @param sources: list, 每一项的源句
+    @param scores: list, 每一项的分值
+    @return: list, 选中项的序号
+    """
+    heap = [(-score, index) for index, score in enumerate(scores)]
+    heapq.heapify(heap)
+    remaining = len(set(sources))
+    taken = set()
+    order = []
+    skipped_score = None  # 遇到源句已被选中的项的分值，该分值后面的项不再选取
+    while heap and remaining:
+        score, index = heapq.heappop(heap)
+        if score == skipped_score:
+            continue
+        if sources[index] in taken:
+            skipped_score = score
+            continue
+        taken.add(sources[index])
+        order.append(index)
+        remaining -= 1
+    return order
@@ -0,0 +1,84 @@
+'''
+匹配库向量索引：每个业务分类下所有关键点的匹配句向量拼成一个矩阵，一次矩阵乘法完成打分
+'''
+import numpy as np
+from quantize import quantize_unit_rows, dequantize, row_scores
+
+
+class TopicVectorIndex(object):
+    def __init__(self, keypoints, keypoint_vectors, thresholds, precision='float32'):
+        """
+        按业务分类构建L2归一化的float32矩阵
+        @param keypoints: list, 关键点顺序 ['确认业务', '选择期数']
+        @param keypoint_vectors: dict, getsimlist_vec的结果 {"确认业务": [{"sentence": str, "array": np.array([])}]}
+        @param thresholds: dict, word2vec阈值 {"确认业务": 0.9}
+        @param precision: str, 'float32' or 'int8'，int8时矩阵按行量化，每行一个缩放系数，内存约为float32的1/4
+        """
+        self.keypoints = list(keypoints)
+        self.thresholds = np.array([float(thresholds[key]) for key in self.keypoints], dtype=np.float32)
+        self.sentences = []  # 第row行对应的匹配库句子
+        rows = []
+        row_keypoint = []  # 第row行对应的关键点序号
+        for key_num, key in enumerate(self.keypoints):
+            for item in keypoint_vectors[key]:
+                self.sentences.append(item["sentence"])
+                rows.append(item["array"])
+                row_keypoint.append(key_num)
+        self.row_keypoint = np.array(row_keypoint, dtype=np.int32)
+        if rows:
+            matrix = np.asarray(rows, dtype=np.float32)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            norms[norms == 0] = 1
+            self.matrix = matrix / norms
+        else:
+            self.matrix = np.zeros((0, 0), dtype=np.float32)
+        self.scales = None  # int8时每行的缩放系数
+        if precision == 'int8':
+            self.matrix, self.scales = quantize_unit_rows(self.matrix)
+        # 每个有匹配句的关键点在矩阵中的起始行，用于分段取最大值
+        self.segment_keypoint = np.unique(self.row_keypoint)
+        self.segment_start = np.searchsorted(self.row_keypoint, self.segment_keypoint)
+
+    def scores(self, sentence_vec):
+        """
+        句子向量与矩阵所有行的余弦相似度，零向量的分值为0
+        @param sentence_vec: np.array([])
+        @return: np.array([]), 长度等于矩阵行数
+        """
+        vec = np.asarray(sentence_vec, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        if norm == 0 or not len(self.sentences):
+            return np.zeros(len(self.sentences), dtype=np.float32)
+        return row_scores(self.matrix, self.scales, vec / norm)
+
+    def dense_matrix(self):
+        """
+        @return: np.array, float32的归一化矩阵，int8时为还原后的矩阵
+        """
+        if self.scales is None:
+            return self.matrix
+        return dequantize(self.matrix, self.scales)
+
+    def match(self, sentence, sentence_vec):
+        """
+        单句与整个业务分类的匹配库打分，每个关键点取分值最高的匹配句，保留高于阈值的关键点
+        @param sentence: str, 原子句
+        @param sentence_vec: np.array([]), 子句向量
+        @return: list, 按关键点顺序 [{'sentence': '', 'keypoint': '', 'score': 0.93, 'compared_source': '', 'regex': ''}]
+        """
+        result = []
+        if not len(self.segment_start):
+            return result
+        scores = self.scores(sentence_vec)
+        segment_max = np.maximum.reduceat(scores, self.segment_start)
+        passed = np.nonzero(segment_max > self.thresholds[self.segment_keypoint])[0]
+        for segment in passed:
+            start = self.segment_start[segment]
+            end = self.segment_start[segment + 1] if segment + 1 < len(self.segment_start) else len(scores)
+            row = start + int(np.argmax(scores[start:end]))
+            result.append({'sentence': sentence,  # 原子句
+                           'keypoint': self.keypoints[self.segment_keypoint[segment]],
+                           'score': float(segment_max[segment]),  # 相似度分值
+                           'compared_source': self.sentences[row],  # 匹配库中的句子
+                           'regex': ''})
+        return result
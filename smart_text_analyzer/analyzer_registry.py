@@ -0,0 +1,120 @@
+'''
+从数据库加载所有SmartTextAnalyzer并热更新：启动时一次查询读取所有text analyzer，
+之后只轮询id和按内容计算的版本号（view_analyzer_versions），只重新构建新增、修改的text analyzer，
+新的AnalyzerSet构建完成后整体替换，正在处理的批次继续使用旧的AnalyzerSet，结果前后一致
+'''
+import threading
+import logging
+import traceback
+from smart_text_analyzer import SmartTextAnalyzer
+from analyzer_set import AnalyzerSet
+import sys
+sys.path.append("..")
+from database.dao.smart_text_analyzer_dao import SmartTextAnalyzerDAO
+
+error_logger = logging.getLogger("error")
+
+
+class AnalyzerRegistry(object):
+    def __init__(self, dao=SmartTextAnalyzerDAO):
+        """
+        @param dao: 提供load_all_analyzers、load_analyzers_by_ids、view_analyzer_versions的对象，默认为SmartTextAnalyzerDAO
+        """
+        self.dao = dao
+        self.snapshot = AnalyzerSet([])  # 当前版本，只整体替换，不修改
+        self.versions = {}  # {id: 版本号}, 与snapshot对应
+        self.update_lock = threading.Lock()  # 同一时间只有一个线程构建新版本
+        self.reloads = 0  # 重新构建的text analyzer数
+        self._stop = threading.Event()
+        self._thread = None
+
+    def current(self):
+        """
+        一个批次开始时取一次，整个批次都使用这个版本
+        @return: AnalyzerSet
+        """
+        return self.snapshot
+
+    def load(self):
+        """
+        一次查询加载所有text analyzer，替换当前版本；
+        先读版本号再读内容，两次查询之间被修改的text analyzer下次轮询时会重新构建
+        @return: bool, 是否加载成功，失败时保留当前版本
+        """
+        versions = self.dao.view_analyzer_versions()
+        if versions is None:
+            return False
+        rows = self.dao.load_all_analyzers()
+        if rows is None:
+            return False
+        with self.update_lock:
+            analyzers = [SmartTextAnalyzer(**row) for row in rows]
+            self.reloads += len(analyzers)
+            self.swap(analyzers, {row["id"]: versions.get(row["id"]) for row in rows}, previous=None)
+        return True
+
+    def refresh(self):
+        """
+        只读取id和版本号，有新增、修改、删除的text analyzer时构建新版本，
+        没有变化的text analyzer及其所在target分组的编译结果直接复用
+        @return: bool, 是否替换了版本
+        """
+        versions = self.dao.view_analyzer_versions()
+        if versions is None:
+            return False
+        with self.update_lock:
+            changed = [analyzer_id for analyzer_id, version in versions.items() if self.versions.get(analyzer_id) != version]
+            removed = set(self.versions) - set(versions)
+            if not changed and not removed:
+                return False
+            rows = self.dao.load_analyzers_by_ids(changed)
+            if rows is None:
+                return False
+            rebuilt = {row["id"]: SmartTextAnalyzer(**row) for row in rows}
+            self.reloads += len(rebuilt)
+            analyzers = []
+            new_versions = {analyzer_id: versions[analyzer_id] for analyzer_id in rebuilt}  # 没有重新构建的沿用原版本号
+            for analyzer in self.snapshot.analyzers.values():  # 保持原有顺序，修改的text analyzer原地替换
+                if analyzer.id in removed:
+                    continue
+                if analyzer.id in rebuilt:
+                    analyzer = rebuilt.pop(analyzer.id)
+                analyzers.append(analyzer)
+            analyzers.extend(rebuilt.values())  # 新增的text analyzer
+            for analyzer in analyzers:
+                new_versions.setdefault(analyzer.id, self.versions.get(analyzer.id))
+            self.swap(analyzers, new_versions, previous=self.snapshot)
+        return True
+
+    def swap(self, analyzers, versions, previous):
+        """
+        构建新的AnalyzerSet后整体替换，读取方看到的要么是旧版本要么是完整的新版本
+        """
+        snapshot = AnalyzerSet(analyzers, previous=previous)
+        self.versions = versions
+        self.snapshot = snapshot
+
+    def start_polling(self, interval=60):
+        """
+        后台线程每interval秒调用一次refresh
+        @param interval: float, 秒
+        """
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._poll, args=(interval,), daemon=True)
+        self._thread.start()
+
+    def stop_polling(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _poll(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                self.refresh()
+            except Exception:  # 轮询出错时保留当前版本，下次继续
+                error_logger.error("热更新SmartTextAnalyzer时发生错误, %s", traceback.format_exc(), extra={"host": 'localhost'})
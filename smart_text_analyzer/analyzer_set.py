@@ -0,0 +1,150 @@
+'''
+多个SmartTextAnalyzer一起检测：所有text analyzer的regex按target分组合并成RegexScanner，每个句子只扫描一遍；
+匹配句按target分组合并成LevenshteinMatcher，每个对话与所有匹配句一次批量计算；
+每个对话只构建一次TranscriptView，各target分组只遍历自己的句子；
+结果按text analyzer分开，与单个SmartTextAnalyzer.run的结果格式一致
+'''
+import json
+import sys
+from smart_text_analyzer import MAX_RESULT, uses_regex, uses_levenshtein, regex_matched, levenshtein_matched, \
+    merge_matched
+from levenshtein_matcher import LevenshteinMatcher
+from transcript_view import TranscriptView
+sys.path.append("..")
+from common.prefetch import prefetch
+from common.regex_scanner import RegexScanner
+
+
+def same_group(group, previous_group):
+    """
+    @return: bool, 两个分组是否为同样顺序的同一批SmartTextAnalyzer实例
+    """
+    return previous_group is not None and len(group) == len(previous_group) and \
+        all(analyzer is previous for analyzer, previous in zip(group, previous_group))
+
+
+class AnalyzerSet(object):
+    def __init__(self, analyzers, previous=None):
+        """
+        @param analyzers: [SmartTextAnalyzer], name不能重复
+        @param previous: AnalyzerSet, 可选，上一个版本；某个target分组的text analyzer（同一批实例）都没有变化时，
+                         直接复用上一个版本编译好的RegexScanner、LevenshteinMatcher
+        """
+        analyzers = list(analyzers)
+        self.analyzers = {analyzer.name: analyzer for analyzer in analyzers}
+        self.regex_groups = {}  # {target: [SmartTextAnalyzer]}, 保持analyzers的顺序
+        self.levenshtein_groups = {}
+        for analyzer in analyzers:
+            if uses_regex(analyzer.mode):
+                self.regex_groups.setdefault(analyzer.target, []).append(analyzer)
+            if uses_levenshtein(analyzer.mode):
+                self.levenshtein_groups.setdefault(analyzer.target, []).append(analyzer)
+        self.scanners = {}
+        for target, group in self.regex_groups.items():
+            if previous is not None and same_group(group, previous.regex_groups.get(target)):
+                self.scanners[target] = previous.scanners[target]
+            else:
+                self.scanners[target] = RegexScanner([(analyzer.name, analyzer.regex) for analyzer in group])
+        self.matchers = {}
+        for target, group in self.levenshtein_groups.items():
+            if previous is not None and same_group(group, previous.levenshtein_groups.get(target)):
+                self.matchers[target] = previous.matchers[target]
+            else:
+                self.matchers[target] = LevenshteinMatcher(
+                    [(analyzer.name, analyzer.matched_sentences, analyzer.threshold) for analyzer in group])
+
+    def prefilter_stats(self):
+        """
+        regex字面量预过滤的统计，所有target分组相加
+        @return: {"sentences": int,  # 扫描的句子数（每个target分组分别计）
+                  "hits": int,  # 预过滤后仍需执行正则的句子数
+                  "skips": int,  # 预过滤直接排除的句子数
+                  "regex_run": int,  # 执行的pattern数
+                  "regex_skipped": int}  # 预过滤跳过的pattern数
+        """
+        stats = {"sentences": 0, "hits": 0, "skips": 0, "regex_run": 0, "regex_skipped": 0}
+        for scanner in self.scanners.values():
+            for key in stats:
+                stats[key] += scanner.stats[key]
+        return stats
+
+    def levenshtein_stats(self):
+        """
+        levenshtein剪枝统计，所有target分组相加
+        @return: {"pairs": int,  # 句子对总数
+                  "pruned_length": int,  # 长度上界剪掉的句子对
+                  "pruned_overlap": int,  # 字符重合数上界剪掉的句子对
+                  "computed": int}  # 参与LCS批量计算的句子对
+        """
+        stats = {"pairs": 0, "pruned_length": 0, "pruned_overlap": 0, "computed": 0}
+        for matcher in self.matchers.values():
+            for key in stats:
+                stats[key] += matcher.stats[key]
+        return stats
+
+    def run(self, transcripts, dialog_id, view=None):
+        """
+        @param transcripts: [{"speech": str, "target": "坐席 or 客户", "start_time": str, "end_time": str}]
+        @param dialog_id: str
+        @param view: TranscriptView, 可选，为None时由transcripts构建，所有text analyzer共用
+        @return: {name: SmartTextAnalyzer.run的结果}
+        """
+        view = view or TranscriptView(transcripts)
+        regex_hits = {name: {} for name in self.analyzers}  # {name: {句子下标: regex_matched的结果}}
+        for target, scanner in self.scanners.items():
+            indices, texts = view.select(target)
+            for index, text in zip(indices, texts):
+                for name, reg in scanner.matches(text):
+                    regex_hits[name][index] = regex_matched(transcripts[index], reg)
+        levenshtein_hits = {name: {} for name in self.analyzers}
+        for target, matcher in self.matchers.items():
+            indices, texts = view.select(target)
+            for name, hits in matcher.match(texts).items():
+                for i, score, matched_sentence in hits:
+                    levenshtein_hits[name][indices[i]] = levenshtein_matched(transcripts[indices[i]], score, matched_sentence)
+        return {name: {"id": dialog_id, "target": analyzer.target,
+                       "matched": merge_matched(regex_hits[name], levenshtein_hits[name])}
+                for name, analyzer in self.analyzers.items()}
+
+    def analyze_dialog(self, dialog):
+        '''
+        所有text analyzer测试单个对话
+        @param dialog: {"transcripts": [{},{}], "id": str}
+        @return: {name: SmartTextAnalyzer.analyze_dialog的结果}, 只包含有匹配句子的text analyzer
+        '''
+        result = self.run(transcripts=dialog["transcripts"], dialog_id=dialog["id"])
+        matched = {name: item for name, item in result.items() if item["matched"]}
+        if not matched:
+            return {}
+        transcripts = json.dumps(dialog["transcripts"], ensure_ascii=False)
+        return {name: {"id": dialog["id"],
+                       "target": item["target"],
+                       "matched": item["matched"],
+                       "transcripts": transcripts} for name, item in matched.items()}
+
+    def test(self, dialogs):
+        '''
+        所有text analyzer测试多个对话，每个text analyzer最多返回MAX_RESULT个对话，与各自调用test的结果一致
+        @param dialogs: [{"transcripts": [{},{}], "id": str}]
+        @return: {name: SmartTextAnalyzer.test的结果}
+        '''
+        matched = {name: [] for name in self.analyzers}
+        for dialog in dialogs:
+            for name, item in self.analyze_dialog(dialog).items():
+                if len(matched[name]) < MAX_RESULT:  # TODO 仅供测试，只测试MAX_RESULT个对话
+                    matched[name].append(item)
+            if all(len(items) == MAX_RESULT for items in matched.values()):
+                break
+        return matched
+
+    def iter_test(self, dialog_iterable, prefetch_size=0):
+        '''
+        流式测试多个对话，不受MAX_RESULT限制
+        @param dialog_iterable: 任意可迭代对象，每一项为 {"transcripts": [{},{}], "id": str}
+        @param prefetch_size: int, 后台线程预读的对话数
+        @return generator, 只返回有匹配的对话，每一项为analyze_dialog的结果
+        '''
+        for dialog in prefetch(dialog_iterable, prefetch_size):
+            result = self.analyze_dialog(dialog)
+            if result:
+                yield result
@@ -0,0 +1,144 @@
+'''
+text analyzer性能测试：合成的text analyzer和对话，对比只做regex与levenshtein、all模式的耗时，
+并与逐个句子、逐个匹配句调用Levenshtein.ratio的原始实现核对结果
+'''
+import random
+import sys
+import time
+import Levenshtein
+from smart_text_analyzer import SmartTextAnalyzer, MODES, merge_matched, regex_matched, levenshtein_matched
+from analyzer_set import AnalyzerSet
+from transcript_view import TranscriptView, normalize_speech
+
+PATTERNS = ["(没|不)(懂|理解|知道)", "你说什么", "重复.*?一遍", "(不明白|不理解).*?(吗|吧)", "(说|讲).*不明白",
+            "回答.*?问题", "对牛弹琴", "打马虎眼", "费劲", "再.*?(回答|重复)", "你.*?有问题", "(听|说|解释).*?(没|不)清楚",
+            "糊涂", "你.*?新来的", "[^是]不是这个意思", "乱七八糟的", "换.人接", "没听懂", "能听到吗"]
+PHRASES = ["您好请问有什么可以帮您", "我想查询一下我的话费", "这个套餐怎么办理", "您稍等我帮您看一下", "好的谢谢再见",
+           "我没听懂你再说一遍", "你们这个服务太差了", "我要投诉你们", "请问还有其他问题吗", "不好意思让您久等了",
+           "你到底会不会回答问题", "我听不清楚你说什么", "麻烦您换个人来接", "这个费用是怎么算的", "我不明白你的意思"]
+FILLER = "嗯好的那个您稍等一下我这边帮您看一下是这样的然后呢就是说"
+
+
+def add_noise(sentence, rnd, noise):
+    '''
+    按比例随机删字、插入填充字，模拟语音识别的误差
+    '''
+    chars = []
+    for char in sentence:
+        if rnd.random() >= noise:
+            chars.append(char)
+        if rnd.random() < noise:
+            chars.append(rnd.choice(FILLER))
+    return ''.join(chars)
+
+
+def synthetic_analyzers(count, mode, seed=0):
+    '''
+    @param count: int, text analyzer数
+    @param mode: str, 所有text analyzer的mode
+    @return: [SmartTextAnalyzer], 每个text analyzer有几个regex和几个匹配句
+    '''
+    rnd = random.Random(seed)
+    analyzers = []
+    for i in range(count):
+        analyzers.append(SmartTextAnalyzer(
+            id=str(i), name="analyzer%d" % i, description="", target=rnd.choice(["all", "坐席", "客户"]),
+            matched_sentences=[add_noise(phrase, rnd, 0.2) for phrase in rnd.sample(PHRASES, 4)],
+            threshold=rnd.choice([0.6, 0.7, 0.8]), regex=rnd.sample(PATTERNS, 3), mode=mode, created_datetime=None))
+    return analyzers
+
+
+def synthetic_dialogs(count, turns=30, noise=0.1, seed=0):
+    '''
+    @return: [{"transcripts": [{}], "id": str}], 句子为PHRASES加噪声或随机填充语
+    '''
+    rnd = random.Random(seed)
+    dialogs = []
+    for i in range(count):
+        transcripts = []
+        for turn in range(turns):
+            if rnd.random() < 0.5:
+                speech = add_noise(rnd.choice(PHRASES), rnd, noise)
+            else:
+                speech = ''.join(rnd.choice(FILLER) for _ in range(rnd.randint(2, 30)))
+            if rnd.random() < 0.1:  # 语音识别结果中夹杂的空格
+                position = rnd.randint(0, len(speech))
+                speech = speech[:position] + ' ' + speech[position:]
+            transcripts.append({"speech": speech, "target": "坐席" if turn % 2 == 0 else "客户",
+                                "start_time": "", "end_time": ""})
+        dialogs.append({"transcripts": transcripts, "id": str(i)})
+    return dialogs
+
+
+def reference_run(analyzer, transcripts, dialog_id):
+    '''
+    逐个句子、逐个匹配句调用Levenshtein.ratio、逐个pattern调用re.search的原始实现（句子同样先归一化），作为对照
+    '''
+    import re
+    regex_hits = {}
+    levenshtein_hits = {}
+    for index, sentence in enumerate(transcripts):
+        if analyzer.target != "all" and sentence["target"] != analyzer.target:
+            continue
+        text = normalize_speech(sentence["speech"])
+        if analyzer.mode != "levenshtein":
+            for reg in analyzer.regex:
+                if re.search(reg, text):
+                    regex_hits[index] = regex_matched(sentence, reg)
+                    break
+        if analyzer.mode in ("all", "levenshtein"):
+            best, best_sentence = analyzer.threshold, None
+            for matched_sentence in analyzer.matched_sentences or []:
+                score = Levenshtein.ratio(matched_sentence, text)
+                if score > best:
+                    best, best_sentence = score, matched_sentence
+            if best_sentence is not None:
+                levenshtein_hits[index] = levenshtein_matched(sentence, best, best_sentence)
+    return {"id": dialog_id, "target": analyzer.target, "matched": merge_matched(regex_hits, levenshtein_hits)}
+
+
+def benchmark(analyzer_count=50, dialog_count=200, seed=0):
+    '''
+    @return: {mode: {"dialogs_per_second": float,  # AnalyzerSet
+                     "per_analyzer_dialogs_per_second": float,  # 逐个text analyzer调用run，共用每个对话的TranscriptView
+                     "reference_dialogs_per_second": float,  # 原始实现
+                     "matched": int, "mismatched": int, "levenshtein_stats": {}}}
+    '''
+    dialogs = synthetic_dialogs(dialog_count, seed=seed)
+    report = {}
+    for mode in MODES:
+        analyzers = synthetic_analyzers(analyzer_count, mode, seed=seed)
+        analyzer_set = AnalyzerSet(analyzers)
+        start = time.time()
+        results = [analyzer_set.run(dialog["transcripts"], dialog["id"]) for dialog in dialogs]
+        elapsed = time.time() - start
+        start = time.time()
+        for dialog in dialogs:
+            view = TranscriptView(dialog["transcripts"])
+            for analyzer in analyzers:
+                analyzer.run(dialog["transcripts"], dialog["id"], view=view)
+        per_analyzer_elapsed = time.time() - start
+        start = time.time()
+        references = [{analyzer.name: reference_run(analyzer, dialog["transcripts"], dialog["id"]) for analyzer in analyzers}
+                      for dialog in dialogs]
+        reference_elapsed = time.time() - start
+        report[mode] = {"dialogs_per_second": len(dialogs) / elapsed,
+                        "per_analyzer_dialogs_per_second": len(dialogs) / per_analyzer_elapsed,
+                        "reference_dialogs_per_second": len(dialogs) / reference_elapsed,
+                        "matched": sum(len(item["matched"]) for result in results for item in result.values()),
+                        "mismatched": sum(result != reference for result, reference in zip(results, references)),
+                        "levenshtein_stats": analyzer_set.levenshtein_stats()}
+    return report
+
+
+if __name__ == '__main__':
+    # python benchmark.py [text analyzer数] [对话数]
+    analyzer_count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    dialog_count = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    for mode, item in benchmark(analyzer_count, dialog_count).items():
+        print("mode=%s: AnalyzerSet %.1f 对话/秒, 逐个text analyzer %.1f 对话/秒, 原始实现 %.1f 对话/秒, "
+              "匹配句子数 %d, 结果不一致的对话数 %d" %
+              (mode, item["dialogs_per_second"], item["per_analyzer_dialogs_per_second"],
+               item["reference_dialogs_per_second"], item["matched"], item["mismatched"]))
+        if mode != "regex":
+            print("    levenshtein剪枝：", item["levenshtein_stats"])
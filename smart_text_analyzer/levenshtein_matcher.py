@@ -0,0 +1,154 @@
+'''
+多个text analyzer的匹配句一起做Levenshtein匹配：Levenshtein.ratio = 2 * LCS / (len1 + len2)，
+计算前用长度和字符重合数的上界排除达不到阈值的句子对，一个对话剩下的所有句子对的LCS用numpy一次批量计算
+（按匹配句的字逐行递推，行内用cummax），递推中LCS的上界达不到阈值的句子对提前结束
+'''
+import numpy as np
+
+EPS = 1e-9
+PAD_MATCHED = -1  # 匹配句补齐的字符编码，与任何字都不相等
+PAD_SENTENCE = -2  # 对话句子补齐的字符编码
+
+
+def encode(sentences, pad):
+    '''
+    @param sentences: [str]
+    @param pad: int, 补齐的字符编码
+    @return codes: np.array, int32, shape=(len(sentences), 最大长度)，每个字的unicode编码
+    @return lengths: np.array, int64
+    '''
+    lengths = np.array([len(sentence) for sentence in sentences], dtype=np.int64)
+    codes = np.full((len(sentences), lengths.max() if len(sentences) else 0), pad, dtype=np.int32)
+    for i, sentence in enumerate(sentences):
+        codes[i, :lengths[i]] = np.frombuffer(sentence.encode('utf-32-le'), dtype=np.uint32)
+    return codes, lengths
+
+
+def char_counts(codes, vocab):
+    '''
+    @param codes: np.array, encode的结果
+    @param vocab: np.array, 升序的字符编码
+    @return: np.array, shape=(句子数, len(vocab))，每个句子中每个字的出现次数，不在vocab中的字忽略
+    '''
+    if not len(vocab):
+        return np.zeros((len(codes), 0), dtype=np.float32)
+    columns = np.minimum(np.searchsorted(vocab, codes), len(vocab) - 1)
+    valid = vocab[columns] == codes
+    index = (np.arange(len(codes))[:, None] * len(vocab) + columns)[valid]
+    return np.bincount(index, minlength=len(codes) * len(vocab)).reshape(len(codes), len(vocab)).astype(np.float32)
+
+
+def batch_lcs(matched_codes, matched_lengths, codes, needed):
+    '''
+    句子对的最长公共子序列长度，所有句子对一起按匹配句的字逐行递推
+    @param matched_codes: np.array, shape=(p, 匹配句最大长度)，每个句子对的匹配句
+    @param matched_lengths: np.array, shape=(p,)
+    @param codes: np.array, shape=(p, 句子最大长度)，每个句子对的对话句子
+    @param needed: np.array, shape=(p,)，超过阈值所需的LCS长度，LCS的上界不超过它时提前结束
+    @return: np.array, shape=(p,)，提前结束的句子对LCS不准确，但一定达不到阈值
+    '''
+    lcs = np.zeros(len(codes), dtype=np.int32)
+    pairs = np.arange(len(codes))
+    dp = np.zeros((len(codes), codes.shape[1] + 1), dtype=np.int32)
+    for k in range(matched_codes.shape[1]):
+        eq = codes == matched_codes[:, k][:, None]
+        step = np.maximum(dp[:, 1:], dp[:, :-1] + eq)
+        np.maximum.accumulate(step, axis=1, out=dp[:, 1:])
+        # 剩下的字全部匹配时LCS也达不到阈值的句子对不再计算
+        keep = dp[:, -1] + np.maximum(matched_lengths - k - 1, 0) > needed
+        if not keep.all():
+            lcs[pairs[~keep]] = dp[~keep, -1]
+            pairs, dp, codes, matched_codes = pairs[keep], dp[keep], codes[keep], matched_codes[keep]
+            matched_lengths, needed = matched_lengths[keep], needed[keep]
+            if not len(pairs):
+                break
+    lcs[pairs] = dp[:, -1]
+    return lcs
+
+
+class LevenshteinMatcher(object):
+    def __init__(self, keyed_sentences):
+        """
+        @param keyed_sentences: list, 按text analyzer顺序 [(name, [匹配句], 阈值)]，
+                                相同的匹配句只计算一次
+        """
+        self.sentences = []  # 去重后的匹配句
+        sentence_row = {}
+        self.keys = []  # [(name, np.array(匹配句行号), 阈值)]
+        for name, sentences, threshold in keyed_sentences:
+            rows = []
+            for sentence in sentences or []:
+                if sentence not in sentence_row:
+                    sentence_row[sentence] = len(self.sentences)
+                    self.sentences.append(sentence)
+                rows.append(sentence_row[sentence])
+            if rows:
+                self.keys.append((name, np.array(rows, dtype=np.int64), float(threshold)))
+        # 每个匹配句取用到它的text analyzer中最低的阈值，用于剪枝
+        self.row_threshold = np.full(len(self.sentences), np.inf)
+        for name, rows, threshold in self.keys:
+            self.row_threshold[rows] = np.minimum(self.row_threshold[rows], threshold)
+        self.row_keys = [[] for sentence in self.sentences]  # 每个匹配句对应的self.keys下标
+        for key_num, (name, rows, threshold) in enumerate(self.keys):
+            for row in rows:
+                self.row_keys[row].append(key_num)
+        self.codes, self.lengths = encode(self.sentences, PAD_MATCHED)
+        self.vocab = np.unique(self.codes[self.codes != PAD_MATCHED])
+        counts = char_counts(self.codes, self.vocab)
+        # 字符重合数 sum(min(a, b)) = sum_t (a >= t) · (b >= t)，拆成几次矩阵乘法
+        self.count_levels = [(counts >= level).astype(np.float32) for level in range(1, int(counts.max(initial=0)) + 1)]
+        self.stats = {"pairs": 0,  # 句子对总数
+                      "pruned_length": 0,  # 长度上界剪掉的句子对
+                      "pruned_overlap": 0,  # 字符重合数上界剪掉的句子对
+                      "computed": 0}  # 参与LCS批量计算的句子对
+
+    def scores(self, sentences):
+        """
+        @param sentences: [str], 对话句子
+        @return: np.array, shape=(匹配句数, len(sentences))，Levenshtein.ratio；
+                 被剪枝的句子对一定达不到阈值，分值为0或不准确（不超过阈值）
+        """
+        scores = np.zeros((len(self.sentences), len(sentences)))
+        if not len(self.sentences) or not len(sentences):
+            return scores
+        codes, lengths = encode(sentences, PAD_SENTENCE)
+        empty = (self.lengths[:, None] == 0) & (lengths[None, :] == 0)  # 两句都为空时Levenshtein.ratio为1
+        scores[empty] = 1.0
+        lensum = np.where(empty, 1, self.lengths[:, None] + lengths[None, :])
+        threshold = self.row_threshold[:, None] - EPS
+        length_passed = 2.0 * np.minimum(self.lengths[:, None], lengths[None, :]) / lensum > threshold
+        counts = char_counts(codes, self.vocab)
+        overlap = sum(level.dot((counts >= i + 1).T.astype(np.float32)) for i, level in enumerate(self.count_levels))
+        alive = length_passed & (2.0 * overlap / lensum > threshold)
+        self.stats["pairs"] += alive.size
+        self.stats["pruned_length"] += alive.size - int(length_passed.sum())
+        self.stats["pruned_overlap"] += int(length_passed.sum()) - int(alive.sum())
+        self.stats["computed"] += int(alive.sum())
+        if not alive.any():
+            return scores
+        rows, columns = np.nonzero(alive)
+        lensum = lensum[rows, columns]
+        needed = np.floor(threshold[rows, 0] * lensum / 2.0 + EPS)  # LCS不超过needed时ratio不超过阈值
+        lcs = batch_lcs(self.codes[rows], self.lengths[rows], codes[columns], needed)
+        scores[rows, columns] = 1.0 - (lensum - 2.0 * lcs) / lensum  # 与Levenshtein.ratio的计算顺序一致，浮点结果相同
+        return scores
+
+    def match(self, sentences):
+        """
+        与逐个句子、逐个匹配句调用Levenshtein.ratio的结果一致：分值超过阈值时取分值最高的匹配句，分值相同时取靠前的
+        @param sentences: [str], 对话句子
+        @return: {name: [(句子下标, 分值, 匹配句)]}, 按句子顺序，只包含有匹配的text analyzer
+        """
+        scores = self.scores(sentences)
+        result = {}
+        # 只有分值超过最低阈值的匹配句所属的text analyzer可能有匹配
+        passed_rows = np.nonzero((scores > self.row_threshold[:, None]).any(axis=1))[0]
+        for key_num in sorted(set(key_num for row in passed_rows for key_num in self.row_keys[row])):
+            name, rows, threshold = self.keys[key_num]
+            key_scores = scores[rows]
+            best = np.argmax(key_scores, axis=0)
+            best_scores = key_scores[best, np.arange(len(sentences))]
+            passed = np.nonzero(best_scores > threshold)[0]
+            if len(passed):
+                result[name] = [(int(i), float(best_scores[i]), self.sentences[rows[best[i]]]) for i in passed]
+        return result
@@ -1,11 +1,10 @@
 '''
 调用class interface，以及从DB中读取模型
 '''
-from smart_text_analyzer import SmartTextAnalyzer
+from analyzer_registry import AnalyzerRegistry
 
 import sys
 sys.path.append("..")
-from database.dao.smart_text_analyzer_dao import SmartTextAnalyzerDAO
 from database.dao.dialogs_dao import DialogsDAO
 
 if __name__ == '__main__':
@@ -15,20 +14,14 @@ if __name__ == '__main__':
  
     # 每一个text analyzer都对应着一个SmartTextAnalyzer instance，应该在后台服务启动的时候根据db创建所有的text analyzer
 
-    # 查看所有的SmartTextAnalyzer
-    all_analyzers = SmartTextAnalyzerDAO.view_all_analyzers()  # [{id: "id", name: "name"}]
-    text_analyzer = {}
-    for analyzer in all_analyzers:
-        id = analyzer["id"]
-        name = analyzer["name"]
-        analyzer = SmartTextAnalyzerDAO.view_analyzer_by_id(analyzer_id=id)
-        # print("%s regex:" % name, analyzer["regex"])
-        # exit()
-        text_analyzer[name] = SmartTextAnalyzer(id=id, name=name, description=analyzer["description"], 
-                                                target=analyzer["target"],matched_sentences=analyzer["matched_sentences"], 
-                                                threshold=analyzer["threshold"], regex=analyzer["regex"], mode=analyzer["mode"], 
-                                                created_datetime=analyzer["created_datetime"])
+    # 一次查询加载所有的SmartTextAnalyzer，后台每60秒检查一次版本号，只重新构建有变化的text analyzer
+    registry = AnalyzerRegistry()
+    if not registry.load():
+        print('******从数据库加载SmartTextAnalyzer失败******')
+        sys.exit(1)
+    registry.start_polling(interval=60)
 
+    # text_analyzer = registry.current().analyzers  # {name: SmartTextAnalyzer}
     # for name in text_analyzer:
     #     # 测试单个对话，仅供测试，实际部署不要使用该方法，而是test
     #     transcripts = [{"speech": "不知道你在说什么?", "target": "客户",
@@ -44,8 +37,7 @@ if __name__ == '__main__':
 
     #     exit()
 
-    # 测试从DB中读对话，然后用text_analyzer检测
-    for name in text_analyzer:
-        print("%s--多个对话测试：" % name, text_analyzer[name].test(dialogs=dialogs), '\n')
-
-        exit()
\ No newline at end of file
+    # 测试从DB中读对话，然后用所有text_analyzer一起检测，每个句子只扫描一遍；一个批次内使用同一个版本
+    analyzer_set = registry.current()
+    for name, matched in analyzer_set.test(dialogs=dialogs).items():
+        print("%s--多个对话测试：" % name, matched, '\n')
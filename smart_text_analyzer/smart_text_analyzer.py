@@ -1,8 +1,58 @@
 import pandas as pd
 import re
 import json
+import sys
+sys.path.append("..")
+from common.prefetch import prefetch
+from common.regex_scanner import RegexScanner
+from levenshtein_matcher import LevenshteinMatcher
+from transcript_view import TranscriptView
 
 MAX_RESULT = 10
+MODES = ["all", "levenshtein", "regex"]
+
+
+def uses_regex(mode):
+    return mode != "levenshtein"  # 其它取值按原来的行为只做regex
+
+
+def uses_levenshtein(mode):
+    return mode in ("all", "levenshtein")
+
+
+def regex_matched(sentence, reg):
+    """
+    @param sentence: {"speech": str, "target": str, "start_time": str, "end_time": str}
+    @param reg: str, 匹配到的regex pattern
+    @return: run_regex结果中matched的一项
+    """
+    return {"score": 1, "source": sentence["speech"], "matched": "", "start_time": sentence["start_time"],
+            "end_time": sentence["end_time"], "origin": sentence["speech"], "regex": reg}
+
+
+def levenshtein_matched(sentence, score, matched):
+    """
+    @param sentence: {"speech": str, "target": str, "start_time": str, "end_time": str}
+    @param score: float, Levenshtein.ratio
+    @param matched: str, 分值最高的匹配句
+    @return: run_levenshtein结果中matched的一项
+    """
+    return {"score": score, "source": sentence["speech"], "matched": matched, "start_time": sentence["start_time"],
+            "end_time": sentence["end_time"], "origin": sentence["speech"], "regex": ""}
+
+
+def merge_matched(regex_hits, levenshtein_hits):
+    """
+    按句子合并regex和levenshtein的结果，每个句子取分值高的一项，分值相同时取regex
+    @param regex_hits: {句子下标: regex_matched的结果}
+    @param levenshtein_hits: {句子下标: levenshtein_matched的结果}
+    @return: list, 按句子顺序
+    """
+    merged = dict(levenshtein_hits)
+    for index, item in regex_hits.items():
+        if index not in merged or item["score"] >= merged[index]["score"]:
+            merged[index] = item
+    return [merged[index] for index in sorted(merged)]
 
 
 class SmartTextAnalyzer:
@@ -29,12 +79,56 @@ class SmartTextAnalyzer:
         self.regex = regex   # [str,str]
         self.mode = mode
         self.created_datetime = created_datetime  
+        # 单独检测时第一次用到才编译pattern、编码匹配句；AnalyzerSet按target分组自行编译，不用这里的
+        self._regex_scanner = None
+        self._levenshtein_matcher = None
+
+    def regex_scanner(self):
+        """
+        @return: RegexScanner, 只包含本text analyzer的pattern
+        """
+        if self._regex_scanner is None:
+            self._regex_scanner = RegexScanner([(self.name, self.regex)] if uses_regex(self.mode) else [])
+        return self._regex_scanner
+
+    def levenshtein_matcher(self):
+        """
+        @return: LevenshteinMatcher, 只包含本text analyzer的匹配句
+        """
+        if self._levenshtein_matcher is None:
+            self._levenshtein_matcher = LevenshteinMatcher(
+                [(self.name, self.matched_sentences, self.threshold)] if uses_levenshtein(self.mode) else [])
+        return self._levenshtein_matcher
+
+    def regex_hits(self, view):
+        """
+        @param view: TranscriptView
+        @return: {句子下标: regex_matched的结果}
+        """
+        hits = {}
+        indices, texts = view.select(self.target)
+        for index, text in zip(indices, texts):
+            for name, reg in self.regex_scanner().matches(text):
+                hits[index] = regex_matched(view.transcripts[index], reg)
+        return hits
+
+    def levenshtein_hits(self, view):
+        """
+        @param view: TranscriptView
+        @return: {句子下标: levenshtein_matched的结果}
+        """
+        indices, texts = view.select(self.target)
+        hits = {}
+        for i, score, matched_sentence in self.levenshtein_matcher().match(texts).get(self.name, []):
+            hits[indices[i]] = levenshtein_matched(view.transcripts[indices[i]], score, matched_sentence)
+        return hits
 
-    def run_regex(self, transcripts, dialog_id):
+    def run_regex(self, transcripts, dialog_id, view=None):
         """
         @Description: 针对于单个text analyzer做测试,只测试一个对话
         @param  transcripts: [{"speech": "坐席 or 客户", "target": <string>, "start_time": <string>, "end_time": <string>}]
         @param  dialog_id:str
+        @param  view: TranscriptView, 可选，多个text analyzer检测同一个对话时共用，为None时由transcripts构建
         @return {
                 "id": "",
                 "target": "", # 说话者身份
@@ -42,7 +136,7 @@ class SmartTextAnalyzer:
                     {
                         "score": 0.5454545454545454,  # 对于regex, score=1
                         "source": "没有了",            # 对话句子  
-                        "matched": "",                # 保持格式一致，此处置空
+                        "matched": "",                # levenshtein为匹配句，regex时置空
                         "start_time": "08:06:38",
                         "end_time": "08:06:43",
                         "origin": "没有了没有了",       # 对话句子，与source保持一致
@@ -51,34 +145,48 @@ class SmartTextAnalyzer:
                 ]
             }
         """
-        result = {"id": dialog_id, "target": self.target, "matched": []}
-        for sentence in transcripts:
-            if self.target == "all":
-                for reg in self.regex:
-                    if re.search(reg, sentence["speech"]):
-                        result["matched"].append(
-                            {"score": 1, "source": sentence["speech"], "matched": "", "start_time": sentence["start_time"], "end_time": sentence["end_time"], "origin": sentence["speech"], "regex": reg})
-                        break
-                continue
-            elif self.target == "坐席" and sentence["target"] == "坐席":
-                for reg in self.regex:
-                    if re.search(reg, sentence["speech"]):
-                        result["matched"].append(
-                            {"score": 1, "source": sentence["speech"], "matched": "", "start_time": sentence["start_time"], "end_time": sentence["end_time"], "origin": sentence["speech"], "regex": reg})
-                        break
-                continue
-            elif self.target == "客户" and sentence["target"] == "客户":
-                for reg in self.regex:
-                    if re.search(reg, sentence["speech"]):
-                        result["matched"].append(
-                            {"score": 1, "source": sentence["speech"], "matched": "", "start_time": sentence["start_time"], "end_time": sentence["end_time"], "origin": sentence["speech"], "regex": reg})
-                        break
-                continue
-        return result
+        view = view or TranscriptView(transcripts)
+        return {"id": dialog_id, "target": self.target, "matched": merge_matched(self.regex_hits(view), {})}
+
+    def run_levenshtein(self, transcripts, dialog_id, view=None):
+        """
+        @Description: 对话中所有句子与所有匹配句一次批量计算Levenshtein.ratio，每个句子取分值最高且超过阈值的匹配句
+        @param  transcripts: 同run_regex
+        @param  dialog_id: str
+        @param  view: 同run_regex
+        @return 同run_regex，score为Levenshtein.ratio，matched为匹配句，regex为""
+        """
+        view = view or TranscriptView(transcripts)
+        return {"id": dialog_id, "target": self.target, "matched": merge_matched({}, self.levenshtein_hits(view))}
+
+    def run(self, transcripts, dialog_id, view=None):
+        """
+        @Description: 按mode检测单个对话，mode为all时regex和levenshtein的结果按句子合并，每个句子取分值高的一项
+        @param  transcripts: 同run_regex
+        @param  dialog_id: str
+        @param  view: 同run_regex
+        @return 同run_regex
+        """
+        view = view or TranscriptView(transcripts)
+        regex_hits = self.regex_hits(view) if uses_regex(self.mode) else {}
+        levenshtein_hits = self.levenshtein_hits(view) if uses_levenshtein(self.mode) else {}
+        return {"id": dialog_id, "target": self.target, "matched": merge_matched(regex_hits, levenshtein_hits)}
+
+    def prefilter_stats(self):
+        """
+        regex字面量预过滤的统计，格式同AnalyzerSet.prefilter_stats
+        """
+        return dict(self.regex_scanner().stats)
+
+    def levenshtein_stats(self):
+        """
+        levenshtein剪枝统计，格式同AnalyzerSet.levenshtein_stats
+        """
+        return dict(self.levenshtein_matcher().stats)
 
     def test(self, dialogs):
         '''
-        测试多个对话  # TODO 多种算法合并结果
+        测试多个对话，按mode合并regex和levenshtein的结果
         @param dialogs : [{"transcripts": [{},{}], "id": str}, {"transcripts": [{},{}], "id": str}]
         @return 只返回matched到的对话,如果没有匹配的对话，则返回[]:[{
             "id": str,
@@ -98,18 +206,42 @@ class SmartTextAnalyzer:
         '''
         matched = []
         for dialog in dialogs:
-            result = self.run_regex(transcripts=dialog["transcripts"], dialog_id=dialog["id"])
-            if len(result['matched']):
-                matched.append({
-                    "id": dialog['id'],
-                    "target": self.target,
-                    "matched": result["matched"],
-                    "transcripts": json.dumps(dialog["transcripts"], ensure_ascii=False)
-                })
+            result = self.analyze_dialog(dialog)
+            if result is not None:
+                matched.append(result)
             if len(matched) == MAX_RESULT:  # TODO 仅供测试，只测试MAX_RESULT个对话
                 return matched
         return matched
 
+    def iter_test(self, dialog_iterable, prefetch_size=0):
+        '''
+        流式测试多个对话：逐个读取对话并逐个返回结果，不需要把所有对话和结果同时放在内存中，不受MAX_RESULT限制
+        @param dialog_iterable: 任意可迭代对象（如DialogsDAO.iter_dialogs），每一项为 {"transcripts": [{},{}], "id": str}
+        @param prefetch_size: int, 后台线程预读的对话数，读取与分析重叠进行，为0时不预读
+        @return generator, 只返回matched到的对话，每一项与test结果中的一项一致
+        '''
+        for dialog in prefetch(dialog_iterable, prefetch_size):
+            result = self.analyze_dialog(dialog)
+            if result is not None:
+                yield result
+
+    def analyze_dialog(self, dialog, view=None):
+        '''
+        测试单个对话
+        @param dialog : {"transcripts": [{},{}], "id": str}
+        @param view: TranscriptView, 可选，多个text analyzer共用同一个对话的预处理结果
+        @return 没有匹配的句子时返回None，否则返回test结果中的一项
+        '''
+        result = self.run(transcripts=dialog["transcripts"], dialog_id=dialog["id"], view=view)
+        if not len(result['matched']):
+            return None
+        return {
+            "id": dialog['id'],
+            "target": self.target,
+            "matched": result["matched"],
+            "transcripts": json.dumps(dialog["transcripts"], ensure_ascii=False)
+        }
+
 
 if __name__ == '__main__':
     # 每一个text analyzer都对应着一个SmartTextAnalyzer instance，应该在后台服务启动的时候根据db创建所有的text analyzer
@@ -0,0 +1,41 @@
+'''
+对话的预处理视图：每个对话只处理一次，句子按说话者分成坐席、客户、all三组并预先归一化，
+同一个对话的所有text analyzer共用，每个text analyzer只遍历自己target的句子
+'''
+import re
+
+WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_speech(speech):
+    '''
+    语音识别结果中的空白（如分词后的空格）去掉，其余字符不变
+    @param speech: str
+    @return: str
+    '''
+    return WHITESPACE.sub('', speech or '')
+
+
+class TranscriptView(object):
+    __slots__ = ('transcripts', 'texts', '_targets')
+
+    def __init__(self, transcripts):
+        """
+        @param transcripts: [{"speech": str, "target": "坐席 or 客户", "start_time": str, "end_time": str}]
+        """
+        self.transcripts = transcripts
+        self.texts = [normalize_speech(sentence["speech"]) for sentence in transcripts]  # 与transcripts一一对应
+        indices = {"all": list(range(len(transcripts)))}
+        for index, sentence in enumerate(transcripts):
+            if sentence.get("target") != "all":
+                indices.setdefault(sentence.get("target"), []).append(index)
+        self._targets = {target: (index_list, [self.texts[index] for index in index_list])
+                         for target, index_list in indices.items()}
+
+    def select(self, target):
+        """
+        @param target: str, "all" "坐席" "客户"
+        @return indices: [int], 该target的句子在transcripts中的下标
+        @return texts: [str], 对应的归一化文本
+        """
+        return self._targets.get(target, ([], []))